@@ -10,29 +10,14 @@
 
 # https://www.kaggle.com/navjindervirdee/lstm-neural-network-from-scratch
 
+import argparse
 import numpy as np               #for maths
-import pandas as pd              #for data manipulation
-import matplotlib.pyplot as plt  #for visualization
-import json
+import os
+import sys
+import time
 
-#reading in data
-filename = open('../data/mac_dude_BlinkTest_1.json', 'r')
-
-#loads json file
-data = json.load(filename)
-
-#stores only the eeg data
-eeg = np.array(data['patterns'])
-
-#maps the node number to the data
-inputs = map(lambda p: p['input'], eeg[2:])
-#puts data into a list
-inputs = list(inputs)
-#puts data into an array
-inputs = np.array(inputs)
-
-
-# TODO: Make train dataset and batch size
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from blinkdata import load_recording
 
 ######################
 #                    #
@@ -40,8 +25,8 @@ inputs = np.array(inputs)
 #                    #
 ######################
 
-#embedding size/number of input units
-input_units = 9
+#number of input units (one per eeg channel)
+input_units = 8
 
 #number of hidden neurons
 hidden_units = 100
@@ -58,6 +43,9 @@ beta1 = 0.90
 #beta2 for S parameters used in Adam Optimizer
 beta2 = 0.99
 
+#every array in the engine uses this type
+dtype = np.float32
+
 ########################################################
 #                                                      #
 #                  Activation Functions                #
@@ -65,26 +53,35 @@ beta2 = 0.99
 #   Tanh = (exp(x) - exp(-x)) / (exp(x) + exp(x))      #
 #   Softmax = exp(x)/(sum(exp(x),1))                   #
 #                                                      #
+#   All of them can write into an existing array       #
+#   (out=x works in place) so the hot loop does not    #
+#   allocate                                           #
+#                                                      #
 ########################################################
 
 #Sigmoid Function
-def sigmoid(x):
-    return 1/(1+np.exp(-x))
+def sigmoid(x, out=None):
+    out = np.negative(x, out=out)
+    np.exp(out, out=out)
+    out += 1
+    return np.reciprocal(out, out=out)
 
 #Tanh Activation Function
-def tanh(x):
-    return np.tanh(x)
+def tanh(x, out=None):
+    return np.tanh(x, out=out)
 
 #Softmax Activation Function
 def softmax(x):
-    x_exp = np.exp(x)
-    x_sum = np.sum(exp_x, axis=1).reshape(-1, 1)
+    x_exp = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    x_sum = np.sum(x_exp, axis=-1, keepdims=True)
     x = x_exp / x_sum
     return x
 
-#Derivative of Tanh Function
-def tanh_deriv(x):
-    return 1-(x ** 2)
+#Derivative of Tanh Function (given tanh(x))
+def tanh_deriv(x, out=None):
+    out = np.multiply(x, x, out=out)
+    np.subtract(1, out, out=out)
+    return out
 
 #################################
 #                               #
@@ -92,158 +89,211 @@ def tanh_deriv(x):
 #                               #
 #################################
 
+#the four gate weights are stacked column wise into one matrix
+#[input_units+hidden_units, 4*hidden_units] = [ f | i | o | g ]
+#so a whole lstm step is a single matmul
+def gate_slices(hidden_units):
+    f = slice(0, hidden_units)
+    i = slice(hidden_units, 2*hidden_units)
+    o = slice(2*hidden_units, 3*hidden_units)
+    g = slice(3*hidden_units, 4*hidden_units)
+    return f, i, o, g
+
 def init_params():
     mean = 0  #initializing mean to 0
     std = .01 #initializing standard deviation to .01
 
-    #lstm cell weights
-    forget_gate_weights = np.random.normal(mean, std, (input_units+hidden_units, hidden_units))
-    input_gate_weights  = np.random.normal(mean, std, (input_units+hidden_units, hidden_units))
-    output_gate_weights = np.random.normal(mean, std, (input_units+hidden_units, hidden_units))
-    gate_gate_weights   = np.random.normal(mean, std, (input_units+hidden_units, hidden_units))
+    #lstm cell weights (forget, input, output and gate gate stacked)
+    gate_weights = np.random.normal(mean, std, (input_units+hidden_units, 4*hidden_units))
 
     #hidden to output weights (output cell)
     hidden_output_weights = np.random.normal(mean, std, (hidden_units, output_units))
 
     #saving parameters into a dictionary
     parameters = dict()
-    parameters['fgw'] = forget_gate_weights
-    parameters['igw'] = input_gate_weights
-    parameters['ogw'] = output_gate_weights
-    parameters['ggw'] = gate_gate_weights
-    parameters['how'] = hidden_output_weights
+    parameters['gw'] = gate_weights.astype(dtype)
+    parameters['how'] = hidden_output_weights.astype(dtype)
 
     return parameters
 
+#################################################################################
+#                                   Caches                                      #
+#                                                                               #
+#    concat     [T, B, I+H]  [xt, at-1] fed to the gates at every step          #
+#    gates      [T, B, 4H]   gate activations (fa, ia, oa, ga)                  #
+#    cell       [T+1, B, H]  cell memory, c0 at index 0                         #
+#    tanh_cell  [T, B, H]    tanh(ct), reused by the backward pass              #
+#    activation [T+1, B, H]  hidden activations, a0 at index 0                  #
+#    output     [T, B, O]    output cell predictions                            #
+#                                                                               #
+#    They are allocated once per (T, B) and reused across training steps       #
+#                                                                               #
+#################################################################################
+
+def init_cache(time_steps, batch_size):
+    cache = dict()
+    cache['concat'] = np.zeros([time_steps, batch_size, input_units+hidden_units], dtype=dtype)
+    cache['gates'] = np.empty([time_steps, batch_size, 4*hidden_units], dtype=dtype)
+    cache['cell'] = np.zeros([time_steps+1, batch_size, hidden_units], dtype=dtype)
+    cache['tanh_cell'] = np.empty([time_steps, batch_size, hidden_units], dtype=dtype)
+    cache['activation'] = np.zeros([time_steps+1, batch_size, hidden_units], dtype=dtype)
+    cache['output'] = np.empty([time_steps, batch_size, output_units], dtype=dtype)
+    return cache
+
 ###########################################
 #                                         #
 #               LSTM Cell                 #
 #                                         #
-#  fa = sigmoid(Wf x [xt,at-1])           #
-#  ia = sigmoid(Wi x [xt,at-1])           #
-#  ga = tanh(Wg x [xt,at-1])              #
-#  oa = sigmoid(Wo x [xt,at-1])           #
+#  [fa|ia|oa|ga] = W x [xt,at-1]          #
+#  fa, ia, oa = sigmoid(...)              #
+#  ga = tanh(...)                         #
 #  ct = (fa x ct-1) + (ia x ga)           #
 #  at = oa x tanh(ct)                     #
 #                                         #
+#  Writes into the cache rows it is       #
+#  given instead of returning new arrays  #
+#                                         #
 ###########################################
 
-def lstm_cell(batch_dataset, prev_activation_matrix, prev_cell_matrix, parameters):
-    #get parameters
-    fgw = parameters['fgw']
-    igw = parameters['igw']
-    ogw = parameters['ogw']
-    ggw = parameters['ggw']
-
-    #concat batch data and prev_activation matrix
-    concat_dataset = np.concatenate((batch_dataset,prev_activation_matrix),axis=1)
+def lstm_cell(concat_dataset, prev_cell_matrix, parameters, gates, cell_memory_matrix, tanh_cell, activation_matrix):
+    hidden_units = prev_cell_matrix.shape[1]
+    f, i, o, g = gate_slices(hidden_units)
 
-    #forget gate activations
-    fa = np.matmul(concat_dataset,fgw)
-    fa = sigmoid(fa)
+    #all four gates in one matmul
+    np.matmul(concat_dataset, parameters['gw'], out=gates)
 
-    #input gate activations
-    ia = np.matmul(concat_dataset,igw)
-    ia = sigmoid(ia)
-
-    #output gate activations
-    oa = np.matmul(concat_dataset,ogw)
-    oa = sigmoid(oa)
+    #forget, input and output gates are contiguous: one sigmoid
+    sig = gates[:, :3*hidden_units]
+    sigmoid(sig, out=sig)
 
     #gate gate activations
-    ga = np.matmul(concat_dataset,ggw)
-    ga = tanh_activation(ga)
+    tanh(gates[:, g], out=gates[:, g])
 
     #new cell memory matrix
-    cell_memory_matrix = np.multiply(fa,prev_cell_matrix) + np.multiply(ia,ga)
+    np.multiply(gates[:, f], prev_cell_matrix, out=cell_memory_matrix)
+    np.multiply(gates[:, i], gates[:, g], out=tanh_cell)
+    cell_memory_matrix += tanh_cell
 
     #current activation matrix
-    activation_matrix = np.multiply(oa, tanh_activation(cell_memory_matrix))
-
-    #lets store the activations to be used in back prop
-    lstm_activations = dict()
-    lstm_activations['fa'] = fa
-    lstm_activations['ia'] = ia
-    lstm_activations['oa'] = oa
-    lstm_activations['ga'] = ga
+    tanh(cell_memory_matrix, out=tanh_cell)
+    np.multiply(gates[:, o], tanh_cell, out=activation_matrix)
 
-    return lstm_activations,cell_memory_matrix,activation_matrix
+    return gates, cell_memory_matrix, activation_matrix
 
 ###########################################
 #                                         #
 #             Output Cell                 #
 #                                         #
 #    ot = W x at                          #
-#    ot = softmax(ot)                     #
+#    ot = sigmoid(ot)                     #
+#                                         #
+#  Applied to every time step at once     #
 #                                         #
 ###########################################
 
-def output_cell(activation_matrix,parameters):
+def output_cell(activation_matrix, parameters, out=None):
     #get hidden to output parameters
     how = parameters['how']
 
-    #get outputs
-    output_matrix = np.matmul(activation_matrix,how)
-    output_matrix = softmax(output_matrix)
+    #get outputs (binary blink label, so sigmoid)
+    output_matrix = np.matmul(activation_matrix, how, out=out)
+    output_matrix = sigmoid(output_matrix, out=output_matrix)
 
     return output_matrix
 
 #################################################################################
 #                              Forward Propagation                              #
 #                                                                               #
-#    LSTM Cache :- All lstm cell activation in every cell (fa,ia,ga,oa)         #
-#    Activation Cache : All activation (a0,a1,a2..)                             #
-#    Cell Cache : All cell activations (c0,c1,c2..                              #
-#    Embedding cache : Embeddings of each batch (e0,e1,e2..)                    #
-#    Output Cache : All output (o1,o2,o3... )                                   #
+#    batches : [T, B, input_units] eeg samples                                  #
+#    returns the filled cache (see Caches above)                                #
 #                                                                               #
 #################################################################################
 
-def forward_propagation(batches,parameters,embeddings):
-    #get batch size
-    batch_size = batches[0].shape[0]
-
-    #to store the activations of all the unrollings.
-    lstm_cache = dict()                 #lstm cache
-    activation_cache = dict()           #activation cache
-    cell_cache = dict()                 #cell cache
-    output_cache = dict()               #output cache
-    embedding_cache = dict()            #embedding cache
+def forward_propagation(batches, parameters, cache=None):
+    time_steps, batch_size = batches.shape[0], batches.shape[1]
+    if cache is None:
+        cache = init_cache(time_steps, batch_size)
 
-    #initial activation_matrix(a0) and cell_matrix(c0)
-    a0 = np.zeros([batch_size,hidden_units],dtype=np.float32)
-    c0 = np.zeros([batch_size,hidden_units],dtype=np.float32)
+    #a0 = c0 = 0
+    cache['cell'][0] = 0
+    cache['activation'][0] = 0
+    unroll(batches, parameters, cache)
 
-    #store the initial activations in cache
-    activation_cache['a0'] = a0
-    cell_cache['c0'] = c0
+    #output cell for all time steps in one matmul
+    output_cell(cache['activation'][1:], parameters, out=cache['output'])
 
-    #unroll the names
-    for i in range(len(batches)-1):
-        #get first first character batch
-        batch_dataset = batches[i]
+    return cache
 
-        #get embeddings
-        batch_dataset = get_embeddings(batch_dataset,embeddings)
-        embedding_cache['emb'+str(i)] = batch_dataset
+#runs the lstm over batches [n, B, input_units] starting from the state in
+#cell[0] and activation[0], filling the first n rows of the cache
+def unroll(batches, parameters, cache):
+    time_steps = batches.shape[0]
+    concat = cache['concat']
+    gates = cache['gates']
+    cell = cache['cell']
+    tanh_cell = cache['tanh_cell']
+    activation = cache['activation']
 
-        #lstm cell
-        lstm_activations,ct,at = lstm_cell(batch_dataset,a0,c0,parameters)
+    #inputs for every step are copied in once
+    concat[:time_steps, :, :input_units] = batches
+    concat[0, :, input_units:] = activation[0]
 
-        #output cell
-        ot = output_cell(at,parameters)
+    #unroll the time steps
+    for t in range(time_steps):
+        lstm_cell(concat[t], cell[t], parameters, gates[t], cell[t+1], tanh_cell[t], activation[t+1])
 
-        #store the time 't' activations in caches
-        lstm_cache['lstm' + str(i+1)]  = lstm_activations
-        activation_cache['a'+str(i+1)] = at
-        cell_cache['c' + str(i+1)] = ct
-        output_cache['o'+str(i+1)] = ot
+        #at becomes the hidden half of the next step's input
+        if t + 1 < time_steps:
+            concat[t+1, :, input_units:] = activation[t+1]
 
-        #update a0 and c0 to new 'at' and 'ct' for next lstm cell
-        a0 = at
-        c0 = ct
+#################################################################################
+#                     Checkpointed (recomputing) Forward                        #
+#                                                                               #
+#    Only (a, c) at the start of every segment of `every` steps is kept:        #
+#                                                                               #
+#    saved_cell       [S, B, H]  ct at the start of each segment               #
+#    saved_activation [S, B, H]  at at the start of each segment               #
+#    output           [T, B, O]  output cell predictions                       #
+#    segment          a cache (see Caches above) for `every` steps, shared by  #
+#                     the forward and the segment by segment recompute         #
+#                                                                               #
+#    S = ceil(T / every), so memory is O((T/every + every) B H) instead of     #
+#    O(T B H); every ~ sqrt(T) gives O(sqrt(T)) for one extra forward pass     #
+#                                                                               #
+#################################################################################
 
-    return embedding_cache,lstm_cache,activation_cache,cell_cache,output_cache
+def init_checkpoint_cache(time_steps, batch_size, every):
+    segments = (time_steps + every - 1) // every
+    cache = dict()
+    cache['every'] = every
+    cache['saved_cell'] = np.zeros([segments, batch_size, hidden_units], dtype=dtype)
+    cache['saved_activation'] = np.zeros([segments, batch_size, hidden_units], dtype=dtype)
+    cache['output'] = np.empty([time_steps, batch_size, output_units], dtype=dtype)
+    cache['segment'] = init_cache(min(every, time_steps), batch_size)
+    return cache
+
+def forward_propagation_checkpointed(batches, parameters, cache):
+    time_steps = batches.shape[0]
+    every = cache['every']
+    segment = cache['segment']
+
+    for s, start in enumerate(range(0, time_steps, every)):
+        stop = min(start + every, time_steps)
+        segment['cell'][0] = cache['saved_cell'][s]
+        segment['activation'][0] = cache['saved_activation'][s]
+        unroll(batches[start:stop], parameters, segment)
+        output_cell(segment['activation'][1:stop-start+1], parameters, out=cache['output'][start:stop])
+
+        #the end of this segment is where the next one starts
+        if s + 1 < cache['saved_cell'].shape[0]:
+            cache['saved_cell'][s+1] = segment['cell'][stop-start]
+            cache['saved_activation'][s+1] = segment['activation'][stop-start]
+
+    return cache
+
+#bytes held by a (possibly nested) cache
+def cache_bytes(cache):
+    return sum(cache_bytes(v) if isinstance(v, dict) else getattr(v, 'nbytes', 0) for v in cache.values())
 
 ###########################################################################
 #                                                                         #
@@ -252,435 +302,392 @@ def forward_propagation(batches,parameters,embeddings):
 #   Loss at time t = -sum(Y x log(d) + (1-Y) x log(1-pred)))/m            #
 #   Overall Loss = ∑(Loss(t)) sum of all losses at each time step 't'     #
 #                                                                         #
-#   Accuracy(t) = (Y==predictions,axis=1) for all time steps              #
-#   Accuracy = ((∑Acc(t))/batch_size)/n for all time steps,               #
-#   n is number of chars in name                                          #
+#   Accuracy = mean over time steps and batch of (pred > .5) == Y         #
+#   Perplexity = mean over batch of exp(-mean_t log(p(Y)))                #
 #                                                                         #
 ###########################################################################
 
 #calculate loss, perplexity and accuracy
-def cal_loss_accuracy(batch_labels,output_cache):
-    loss = 0  #to sum loss for each time step
-    acc  = 0  #to sum acc for each time step
-    prob = 1  #probability product of each time step predicted char
-
+def cal_loss_accuracy(batch_labels, output_cache):
     #batch size
-    batch_size = batch_labels[0].shape[0]
+    batch_size = batch_labels.shape[1]
 
-    #loop through each time step
-    for i in range(1,len(output_cache)+1):
-        #get true labels and predictions
-        labels = batch_labels[i]
-        pred = output_cache['o'+str(i)]
+    #keep log() finite
+    pred = np.clip(output_cache, 1e-7, 1 - 1e-7)
 
-        prob = np.multiply(prob,np.sum(np.multiply(labels,pred),axis=1).reshape(-1,1))
-        loss += np.sum((np.multiply(labels,np.log(pred)) + np.multiply(1-labels,np.log(1-pred))),axis=1).reshape(-1,1)
-        acc  += np.array(np.argmax(labels,1)==np.argmax(pred,1),dtype=np.float32).reshape(-1,1)
+    #probability given to the true label at every step
+    prob = batch_labels*pred + (1-batch_labels)*(1-pred)
+    log_prob = np.log(prob)
 
     #calculate perplexity loss and accuracy
-    perplexity = np.sum((1/prob)**(1/len(output_cache)))/batch_size
-    loss = np.sum(loss)*(-1/batch_size)
-    acc  = np.sum(acc)/(batch_size)
-    acc = acc/len(output_cache)
+    perplexity = np.mean(np.exp(-np.mean(np.sum(log_prob, axis=2), axis=0)))
+    loss = -np.sum(log_prob)/batch_size
+    acc = np.mean((pred > .5) == (batch_labels > .5))
 
-    return perplexity,loss,acc
+    return float(perplexity), float(loss), float(acc)
 
 
 
 
-#calculate output cell errors
-def calculate_output_cell_error(batch_labels,output_cache,parameters):
-    #to store the output errors for each time step
-    output_error_cache = dict()
-    activation_error_cache = dict()
+#calculate output cell errors for all time steps at once
+def calculate_output_cell_error(batch_labels, output_cache, parameters):
     how = parameters['how']
 
-    #loop through each time step
-    for i in range(1,len(output_cache)+1):
-        #get true and predicted labels
-        labels = batch_labels[i]
-        pred = output_cache['o'+str(i)]
+    #calculate the output_error for every time step
+    output_error_cache = output_cache - batch_labels
 
-        #calculate the output_error for time step 't'
-        error_output = pred - labels
+    #calculate the activation error for every time step
+    activation_error_cache = np.matmul(output_error_cache, how.T)
 
-        #calculate the activation error for time step 't'
-        error_activation = np.matmul(error_output,how.T)
-
-        #store the output and activation error in dict
-        output_error_cache['eo'+str(i)] = error_output
-        activation_error_cache['ea'+str(i)] = error_activation
-
-    return output_error_cache,activation_error_cache
+    return output_error_cache, activation_error_cache
 
 
 
 #calculate error for single lstm cell
-def calculate_single_lstm_cell_error(activation_output_error,next_activation_error,next_cell_error,parameters,lstm_activation,cell_activation,prev_cell_activation):
+#the four gate errors are written into gate_error [B, 4H]
+def calculate_single_lstm_cell_error(activation_output_error, next_activation_error, next_cell_error, parameters, gates, tanh_cell, prev_cell_activation, gate_error, scratch, concat_error):
+    hidden_units = tanh_cell.shape[1]
+    f, i, o, g = gate_slices(hidden_units)
+    fa, ia, oa, ga = gates[:, f], gates[:, i], gates[:, o], gates[:, g]
+    ef, ei, eo, eg = gate_error[:, f], gate_error[:, i], gate_error[:, o], gate_error[:, g]
+
     #activation error =  error coming from output cell and error coming from the next lstm cell
-    activation_error = activation_output_error + next_activation_error
+    activation_error = np.add(activation_output_error, next_activation_error, out=next_activation_error)
+
+    #sigmoid derivative for f, i and o at once: s x (1-s)
+    sig = gates[:, :3*hidden_units]
+    sig_deriv = gate_error[:, :3*hidden_units]
+    np.subtract(1, sig, out=sig_deriv)
+    sig_deriv *= sig
 
     #output gate error
-    oa = lstm_activation['oa']
-    eo = np.multiply(activation_error,tanh_activation(cell_activation))
-    eo = np.multiply(np.multiply(eo,oa),1-oa)
+    eo *= activation_error
+    eo *= tanh_cell
 
     #cell activation error
-    cell_error = np.multiply(activation_error,oa)
-    cell_error = np.multiply(cell_error,tanh_derivative(tanh_activation(cell_activation)))
+    cell_error = tanh_deriv(tanh_cell, out=scratch)
+    cell_error *= oa
+    cell_error *= activation_error
     #error also coming from next lstm cell
     cell_error += next_cell_error
 
     #input gate error
-    ia = lstm_activation['ia']
-    ga = lstm_activation['ga']
-    ei = np.multiply(cell_error,ga)
-    ei = np.multiply(np.multiply(ei,ia),1-ia)
+    ei *= cell_error
+    ei *= ga
 
     #gate gate error
-    eg = np.multiply(cell_error,ia)
-    eg = np.multiply(eg,tanh_derivative(ga))
+    tanh_deriv(ga, out=eg)
+    eg *= cell_error
+    eg *= ia
 
     #forget gate error
-    fa = lstm_activation['fa']
-    ef = np.multiply(cell_error,prev_cell_activation)
-    ef = np.multiply(np.multiply(ef,fa),1-fa)
+    ef *= cell_error
+    ef *= prev_cell_activation
 
     #prev cell error
-    prev_cell_error = np.multiply(cell_error,fa)
-
-    #get parameters
-    fgw = parameters['fgw']
-    igw = parameters['igw']
-    ggw = parameters['ggw']
-    ogw = parameters['ogw']
+    prev_cell_error = np.multiply(cell_error, fa, out=next_cell_error)
 
-    #embedding + hidden activation error
-    embed_activation_error = np.matmul(ef,fgw.T)
-    embed_activation_error += np.matmul(ei,igw.T)
-    embed_activation_error += np.matmul(eo,ogw.T)
-    embed_activation_error += np.matmul(eg,ggw.T)
-
-    input_hidden_units = fgw.shape[0]
-    hidden_units = fgw.shape[1]
-    input_units = input_hidden_units - hidden_units
+    #input + hidden activation error, one matmul for all four gates
+    embed_activation_error = np.matmul(gate_error, parameters['gw'].T, out=concat_error)
 
     #prev activation error
-    prev_activation_error = embed_activation_error[:,input_units:]
-
-    #input error (embedding error)
-    embed_error = embed_activation_error[:,:input_units]
-
-    #store lstm error
-    lstm_error = dict()
-    lstm_error['ef'] = ef
-    lstm_error['ei'] = ei
-    lstm_error['eo'] = eo
-    lstm_error['eg'] = eg
-
-    return prev_activation_error,prev_cell_error,embed_error,lstm_error
+    prev_activation_error = embed_activation_error[:, input_units:]
 
+    #input error
+    embed_error = embed_activation_error[:, :input_units]
 
+    return prev_activation_error, prev_cell_error, embed_error, gate_error
 
 
-#calculate output cell derivatives
-def calculate_output_cell_derivatives(output_error_cache,activation_cache,parameters):
-    #to store the sum of derivatives from each time step
-    dhow = np.zeros(parameters['how'].shape)
 
-    batch_size = activation_cache['a1'].shape[0]
 
-    #loop through the time steps
-    for i in range(1,len(output_error_cache)+1):
-        #get output error
-        output_error = output_error_cache['eo' + str(i)]
+#calculate output cell derivatives (summed over all time steps in one matmul)
+def calculate_output_cell_derivatives(output_error_cache, activation_cache, parameters):
+    batch_size = activation_cache.shape[1]
+    activations = activation_cache[1:].reshape(-1, activation_cache.shape[2])
+    output_error = output_error_cache.reshape(-1, output_error_cache.shape[2])
+    return np.matmul(activations.T, output_error)/batch_size
 
-        #get input activation
-        activation = activation_cache['a'+str(i)]
-
-        #cal derivative and summing up!
-        dhow += np.matmul(activation.T,output_error)/batch_size
-
-    return dhow
-
-#calculate derivatives for single lstm cell
-def calculate_single_lstm_cell_derivatives(lstm_error,embedding_matrix,activation_matrix):
-    #get error for single time step
-    ef = lstm_error['ef']
-    ei = lstm_error['ei']
-    eo = lstm_error['eo']
-    eg = lstm_error['eg']
-
-    #get input activations for this time step
-    concat_matrix = np.concatenate((embedding_matrix,activation_matrix),axis=1)
-
-    batch_size = embedding_matrix.shape[0]
-
-    #cal derivatives for this time step
-    dfgw = np.matmul(concat_matrix.T,ef)/batch_size
-    digw = np.matmul(concat_matrix.T,ei)/batch_size
-    dogw = np.matmul(concat_matrix.T,eo)/batch_size
-    dggw = np.matmul(concat_matrix.T,eg)/batch_size
-
-    #store the derivatives for this time step in dict
-    derivatives = dict()
-    derivatives['dfgw'] = dfgw
-    derivatives['digw'] = digw
-    derivatives['dogw'] = dogw
-    derivatives['dggw'] = dggw
-
-    return derivatives
+#calculate lstm cell derivatives (summed over all time steps in one matmul)
+def calculate_lstm_cell_derivatives(lstm_error_cache, concat_cache):
+    batch_size = concat_cache.shape[1]
+    concat_matrix = concat_cache.reshape(-1, concat_cache.shape[2])
+    lstm_error = lstm_error_cache.reshape(-1, lstm_error_cache.shape[2])
+    return np.matmul(concat_matrix.T, lstm_error)/batch_size
 
 
 
 
 
 #backpropagation
-def backward_propagation(batch_labels,embedding_cache,lstm_cache,activation_cache,cell_cache,output_cache,parameters):
+#returns the parameter derivatives and the input error [T, B, input_units]
+def backward_propagation(batch_labels, cache, parameters):
+    time_steps, batch_size = batch_labels.shape[0], batch_labels.shape[1]
+    gates = cache['gates']
+    cell = cache['cell']
+    tanh_cell = cache['tanh_cell']
+
     #calculate output errors
-    output_error_cache,activation_error_cache = calculate_output_cell_error(batch_labels,output_cache,parameters)
+    output_error_cache, activation_error_cache = calculate_output_cell_error(batch_labels, cache['output'], parameters)
 
-    #to store lstm error for each time step
-    lstm_error_cache = dict()
+    #to store lstm gate errors for each time step
+    lstm_error_cache = np.empty(gates.shape, dtype=dtype)
 
-    #to store embeding errors for each time step
-    embedding_error_cache = dict()
+    #to store input errors for each time step
+    input_error_cache = np.empty([time_steps, batch_size, input_units], dtype=dtype)
 
     # next activation error
     # next cell error
     #for last cell will be zero
-    eat = np.zeros(activation_error_cache['ea1'].shape)
-    ect = np.zeros(activation_error_cache['ea1'].shape)
+    eat = np.zeros([batch_size, hidden_units], dtype=dtype)
+    ect = np.zeros([batch_size, hidden_units], dtype=dtype)
+    scratch = np.empty([batch_size, hidden_units], dtype=dtype)
+    concat_error = np.empty([batch_size, input_units+hidden_units], dtype=dtype)
 
     #calculate all lstm cell errors (going from last time-step to the first time step)
-    for i in range(len(lstm_cache),0,-1):
+    for t in range(time_steps-1, -1, -1):
         #calculate the lstm errors for this time step 't'
-        pae,pce,ee,le = calculate_single_lstm_cell_error(activation_error_cache['ea'+str(i)],eat,ect,parameters,lstm_cache['lstm'+str(i)],cell_cache['c'+str(i)],cell_cache['c'+str(i-1)])
+        pae, ect, ee, le = calculate_single_lstm_cell_error(activation_error_cache[t], eat, ect, parameters, gates[t], tanh_cell[t], cell[t], lstm_error_cache[t], scratch, concat_error)
 
-        #store the lstm error in dict
-        lstm_error_cache['elstm'+str(i)] = le
+        #store the input error
+        input_error_cache[t] = ee
 
-        #store the embedding error in dict
-        embedding_error_cache['eemb'+str(i-1)] = ee
+        #update the next activation error for previous cell
+        eat[:] = pae
 
-        #update the next activation error and next cell error for previous cell
-        eat = pae
-        ect = pce
-
-
-    #calculate output cell derivatives
+    #calculate the derivatives
     derivatives = dict()
-    derivatives['dhow'] = calculate_output_cell_derivatives(output_error_cache,activation_cache,parameters)
-
-    #calculate lstm cell derivatives for each time step and store in lstm_derivatives dict
-    lstm_derivatives = dict()
-    for i in range(1,len(lstm_error_cache)+1):
-        lstm_derivatives['dlstm'+str(i)] = calculate_single_lstm_cell_derivatives(lstm_error_cache['elstm'+str(i)],embedding_cache['emb'+str(i-1)],activation_cache['a'+str(i-1)])
-
-    #initialize the derivatives to zeros
-    derivatives['dfgw'] = np.zeros(parameters['fgw'].shape)
-    derivatives['digw'] = np.zeros(parameters['igw'].shape)
-    derivatives['dogw'] = np.zeros(parameters['ogw'].shape)
-    derivatives['dggw'] = np.zeros(parameters['ggw'].shape)
-
-    #sum up the derivatives for each time step
-    for i in range(1,len(lstm_error_cache)+1):
-        derivatives['dfgw'] += lstm_derivatives['dlstm'+str(i)]['dfgw']
-        derivatives['digw'] += lstm_derivatives['dlstm'+str(i)]['digw']
-        derivatives['dogw'] += lstm_derivatives['dlstm'+str(i)]['dogw']
-        derivatives['dggw'] += lstm_derivatives['dlstm'+str(i)]['dggw']
+    derivatives['dhow'] = calculate_output_cell_derivatives(output_error_cache, cache['activation'], parameters)
+    derivatives['dgw'] = calculate_lstm_cell_derivatives(lstm_error_cache, cache['concat'])
 
-    return derivatives,embedding_error_cache
+    return derivatives, input_error_cache
 
 
 
-#update the parameters using adam optimizer
-#adam optimization
-def update_parameters(parameters,derivatives,V,S,t):
-    #get derivatives
-    dfgw = derivatives['dfgw']
-    digw = derivatives['digw']
-    dogw = derivatives['dogw']
-    dggw = derivatives['dggw']
-    dhow = derivatives['dhow']
-
-    #get parameters
-    fgw = parameters['fgw']
-    igw = parameters['igw']
-    ogw = parameters['ogw']
-    ggw = parameters['ggw']
+#backpropagation through a checkpointed cache: segments are walked from the
+#last to the first, each one recomputed from its saved (a, c) and then
+#backpropagated with the errors carried in from the segment after it.
+#the derivatives are summed segment by segment, so they match
+#backward_propagation up to float rounding
+def backward_propagation_checkpointed(batch_labels, batches, cache, parameters):
+    time_steps, batch_size = batch_labels.shape[0], batch_labels.shape[1]
+    every = cache['every']
+    segment = cache['segment']
     how = parameters['how']
 
-    #get V parameters
-    vfgw = V['vfgw']
-    vigw = V['vigw']
-    vogw = V['vogw']
-    vggw = V['vggw']
-    vhow = V['vhow']
+    #output errors are [T, B, O], small enough to keep for every step
+    output_error_cache = cache['output'] - batch_labels
 
-    #get S parameters
-    sfgw = S['sfgw']
-    sigw = S['sigw']
-    sogw = S['sogw']
-    sggw = S['sggw']
-    show = S['show']
+    #gate errors of one segment
+    lstm_error_cache = np.empty(segment['gates'].shape, dtype=dtype)
 
-    #calculate the V parameters from V and current derivatives
-    vfgw = (beta1*vfgw + (1-beta1)*dfgw)
-    vigw = (beta1*vigw + (1-beta1)*digw)
-    vogw = (beta1*vogw + (1-beta1)*dogw)
-    vggw = (beta1*vggw + (1-beta1)*dggw)
-    vhow = (beta1*vhow + (1-beta1)*dhow)
+    #to store input errors for each time step
+    input_error_cache = np.empty([time_steps, batch_size, input_units], dtype=dtype)
 
-    #calculate the S parameters from S and current derivatives
-    sfgw = (beta2*sfgw + (1-beta2)*(dfgw**2))
-    sigw = (beta2*sigw + (1-beta2)*(digw**2))
-    sogw = (beta2*sogw + (1-beta2)*(dogw**2))
-    sggw = (beta2*sggw + (1-beta2)*(dggw**2))
-    show = (beta2*show + (1-beta2)*(dhow**2))
+    derivatives = dict()
+    derivatives['dhow'] = np.zeros(how.shape, dtype=dtype)
+    derivatives['dgw'] = np.zeros(parameters['gw'].shape, dtype=dtype)
 
-    #update the parameters
-    fgw = fgw - learning_rate*((vfgw)/(np.sqrt(sfgw) + 1e-6))
-    igw = igw - learning_rate*((vigw)/(np.sqrt(sigw) + 1e-6))
-    ogw = ogw - learning_rate*((vogw)/(np.sqrt(sogw) + 1e-6))
-    ggw = ggw - learning_rate*((vggw)/(np.sqrt(sggw) + 1e-6))
-    how = how - learning_rate*((vhow)/(np.sqrt(show) + 1e-6))
+    #for last cell will be zero
+    eat = np.zeros([batch_size, hidden_units], dtype=dtype)
+    ect = np.zeros([batch_size, hidden_units], dtype=dtype)
+    scratch = np.empty([batch_size, hidden_units], dtype=dtype)
+    concat_error = np.empty([batch_size, input_units+hidden_units], dtype=dtype)
 
-    #store the new weights
-    parameters['fgw'] = fgw
-    parameters['igw'] = igw
-    parameters['ogw'] = ogw
-    parameters['ggw'] = ggw
-    parameters['how'] = how
+    for s in range(cache['saved_cell'].shape[0]-1, -1, -1):
+        start = s*every
+        stop = min(start + every, time_steps)
+        n = stop - start
 
-    #store the new V parameters
-    V['vfgw'] = vfgw
-    V['vigw'] = vigw
-    V['vogw'] = vogw
-    V['vggw'] = vggw
-    V['vhow'] = vhow
+        #recompute the gate activations of this segment
+        segment['cell'][0] = cache['saved_cell'][s]
+        segment['activation'][0] = cache['saved_activation'][s]
+        unroll(batches[start:stop], parameters, segment)
 
-    #store the s parameters
-    S['sfgw'] = sfgw
-    S['sigw'] = sigw
-    S['sogw'] = sogw
-    S['sggw'] = sggw
-    S['show'] = show
+        activation_error_cache = np.matmul(output_error_cache[start:stop], how.T)
+        for t in range(n-1, -1, -1):
+            pae, ect, ee, le = calculate_single_lstm_cell_error(activation_error_cache[t], eat, ect, parameters, segment['gates'][t], segment['tanh_cell'][t], segment['cell'][t], lstm_error_cache[t], scratch, concat_error)
+            input_error_cache[start+t] = ee
+            eat[:] = pae
 
-    return parameters,V,S
+        derivatives['dhow'] += calculate_output_cell_derivatives(output_error_cache[start:stop], segment['activation'][:n+1], parameters)
+        derivatives['dgw'] += calculate_lstm_cell_derivatives(lstm_error_cache[:n], segment['concat'][:n])
 
+    return derivatives, input_error_cache
 
 
 
-#update the Embeddings
-def update_embeddings(embeddings,embedding_error_cache,batch_labels):
-    #to store the embeddings derivatives
-    embedding_derivatives = np.zeros(embeddings.shape)
+#update the parameters using adam optimizer
+#adam optimization (in place, every parameter keyed the same way)
+def update_parameters(parameters, derivatives, V, S, t):
+    for key in parameters:
+        d = derivatives['d'+key]
+        v = V['v'+key]
+        s = S['s'+key]
 
-    batch_size = batch_labels[0].shape[0]
+        #calculate the V parameters from V and current derivatives
+        v *= beta1
+        v += (1-beta1)*d
 
-    #sum the embedding derivatives for each time step
-    for i in range(len(embedding_error_cache)):
-        embedding_derivatives += np.matmul(batch_labels[i].T,embedding_error_cache['eemb'+str(i)])/batch_size
+        #calculate the S parameters from S and current derivatives
+        s *= beta2
+        s += (1-beta2)*(d**2)
 
-    #update the embeddings
-    embeddings = embeddings - learning_rate*embedding_derivatives
-    return embeddings
+        #update the parameters
+        parameters[key] -= learning_rate*(v/(np.sqrt(s) + 1e-6))
 
+    return parameters, V, S
 
 
-def initialize_V(parameters):
-    Vfgw = np.zeros(parameters['fgw'].shape)
-    Vigw = np.zeros(parameters['igw'].shape)
-    Vogw = np.zeros(parameters['ogw'].shape)
-    Vggw = np.zeros(parameters['ggw'].shape)
-    Vhow = np.zeros(parameters['how'].shape)
 
+def initialize_V(parameters):
     V = dict()
-    V['vfgw'] = Vfgw
-    V['vigw'] = Vigw
-    V['vogw'] = Vogw
-    V['vggw'] = Vggw
-    V['vhow'] = Vhow
+    for key in parameters:
+        V['v'+key] = np.zeros(parameters[key].shape, dtype=dtype)
     return V
 
 def initialize_S(parameters):
-    Sfgw = np.zeros(parameters['fgw'].shape)
-    Sigw = np.zeros(parameters['igw'].shape)
-    Sogw = np.zeros(parameters['ogw'].shape)
-    Sggw = np.zeros(parameters['ggw'].shape)
-    Show = np.zeros(parameters['how'].shape)
-
     S = dict()
-    S['sfgw'] = Sfgw
-    S['sigw'] = Sigw
-    S['sogw'] = Sogw
-    S['sggw'] = Sggw
-    S['show'] = Show
+    for key in parameters:
+        S['s'+key] = np.zeros(parameters[key].shape, dtype=dtype)
     return S
 
 
 
 
 
+
+#################################################################################
+#                              Training Dataset                                 #
+#                                                                               #
+#    The recording is cut into windows of time_steps samples, stride samples   #
+#    apart, and batch_size consecutive windows make one [T, B, units] batch.    #
+#    Batches are strided views into the (memory-mapped) recording, so no       #
+#    sample is copied until forward_propagation reads it.                      #
+#                                                                               #
+#################################################################################
+
+#[T, B, units] view of batch_size windows starting at sample start
+def window_batch(data, start, time_steps, batch_size, stride):
+    data = data[start:]
+    row, col = data.strides
+    return np.lib.stride_tricks.as_strided(data, shape=(time_steps, batch_size, data.shape[1]),
+                                           strides=(row, stride*row, col), writeable=False)
+
+#list of (batches, labels) pairs covering the recording
+def make_dataset(inputs, labels, time_steps=50, batch_size=32, stride=None):
+    stride = stride or time_steps
+    span = (batch_size-1)*stride + time_steps
+    dataset = []
+    for start in range(0, inputs.shape[0]-span+1, batch_size*stride):
+        dataset.append((window_batch(inputs, start, time_steps, batch_size, stride),
+                        window_batch(labels, start, time_steps, batch_size, stride)))
+    return dataset
+
+
 #train function
-def train(train_dataset,iters=1000,batch_size=20):
+#train_dataset is a list of (batches, labels) pairs, both [T, B, units]
+#recompute_every keeps only every k-th (a, c) and recomputes the rest in the
+#backward pass (see Checkpointed Forward above)
+#cache may be one made up front for the batch shape (init_cache, or
+#init_checkpoint_cache with recompute_every); it is reallocated if a batch
+#comes in with another shape
+def train(train_dataset,iters=1000,recompute_every=None,cache=None):
     #initalize the parameters
-    parameters = initialize_parameters()
+    parameters = init_params()
 
     #initialize the V and S parameters for Adam
     V = initialize_V(parameters)
     S = initialize_S(parameters)
 
-    #generate the random embeddings
-    embeddings = np.random.normal(0,0.01,(len(vocab),input_units))
-
     #to store the Loss, Perplexity and Accuracy for each batch
     J = []
     P = []
     A = []
 
+    #samples seen, for the throughput report
+    samples = 0
+    start = time.time()
 
     for step in range(iters):
         #get batch dataset
         index = step%len(train_dataset)
-        batches = train_dataset[index]
-
-        #forward propagation
-        embedding_cache,lstm_cache,activation_cache,cell_cache,output_cache = forward_propagation(batches,parameters,embeddings)
+        batches, labels = train_dataset[index]
+
+        #forward propagation, in caches reused while the batch shape stays the same
+        if cache is None or cache['output'].shape[:2] != batches.shape[:2]:
+            if recompute_every:
+                cache = init_checkpoint_cache(batches.shape[0], batches.shape[1], recompute_every)
+            else:
+                cache = init_cache(batches.shape[0], batches.shape[1])
+        if recompute_every:
+            cache = forward_propagation_checkpointed(batches,parameters,cache)
+        else:
+            cache = forward_propagation(batches,parameters,cache)
 
         #calculate the loss, perplexity and accuracy
-        perplexity,loss,acc = cal_loss_accuracy(batches,output_cache)
+        perplexity,loss,acc = cal_loss_accuracy(labels,cache['output'])
 
         #backward propagation
-        derivatives,embedding_error_cache = backward_propagation(batches,embedding_cache,lstm_cache,activation_cache,cell_cache,output_cache,parameters)
+        if recompute_every:
+            derivatives,input_error_cache = backward_propagation_checkpointed(labels,batches,cache,parameters)
+        else:
+            derivatives,input_error_cache = backward_propagation(labels,cache,parameters)
 
         #update the parameters
         parameters,V,S = update_parameters(parameters,derivatives,V,S,step)
 
-        #update the embeddings
-        embeddings = update_embeddings(embeddings,embedding_error_cache,batches)
-
+        samples += batches.shape[0]*batches.shape[1]
 
         J.append(loss)
         P.append(perplexity)
         A.append(acc)
 
-        #print loss, accuracy and perplexity
+        #print loss, accuracy, perplexity and throughput
         if(step%1000==0):
             print("For Single Batch :")
             print('Step       = {}'.format(step))
             print('Loss       = {}'.format(round(loss,2)))
             print('Perplexity = {}'.format(round(perplexity,2)))
             print('Accuracy   = {}'.format(round(acc*100,2)))
+            print('Samples/s  = {}'.format(round(samples/(time.time()-start))))
             print()
 
-    return embeddings, parameters,J,P,A
+    return parameters,J,P,A
+
+
 
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the from-scratch LSTM on blink data windows')
+    parser.add_argument('--data', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'mac_dude_BlinkTest_1.json'))
+    parser.add_argument('--time-steps', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--stride', type=int, help='samples between windows (default: time steps)')
+    parser.add_argument('--iters', type=int, default=1000)
+    parser.add_argument('--target', type=float, default=50000, help='samples/s the run should reach')
+    parser.add_argument('--recompute-every', type=int,
+                        help='keep (a, c) every K steps and recompute the gates in backward (~sqrt of time steps uses least memory)')
+    args = parser.parse_args()
 
+    #reading in data (cached as float32 arrays after the first json parse)
+    recording = load_recording(args.data)
 
+    #eeg inputs and blink labels cut into [T, B, units] batches
+    train_dataset = make_dataset(recording.inputs, recording.outputs, args.time_steps, args.batch_size, args.stride)
 
+    if args.recompute_every:
+        cache = init_checkpoint_cache(args.time_steps, args.batch_size, args.recompute_every)
+    else:
+        cache = init_cache(args.time_steps, args.batch_size)
+    print('Activation cache = {} MB'.format(round(cache_bytes(cache)/1e6, 2)))
 
+    #train runs in the cache measured above rather than allocating its own
+    start = time.time()
+    parameters,J,P,A = train(train_dataset, args.iters, args.recompute_every, cache)
+    elapsed = time.time() - start
 
-print("No compiling errors")
+    samples_per_second = args.iters*args.time_steps*args.batch_size/elapsed
+    print('Final loss = {}, accuracy = {}'.format(round(J[-1],2), round(A[-1]*100,2)))
+    print('Throughput = {} samples/s (target {}: {})'.format(round(samples_per_second), round(args.target),
+                                                          'met' if samples_per_second >= args.target else 'missed'))
@@ -0,0 +1,253 @@
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from blinkdata import load_recording
+from main import Sequence, load_data
+from preprocess import default_pipeline
+from streaming import BlinkDetector
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Winter2019'))
+import LSTM as numpy_lstm
+
+#a benchmark is flagged when its median gets this much slower than the baseline
+THRESHOLD = 1.10
+
+
+#################################
+#                               #
+#          Timing               #
+#                               #
+#################################
+
+#runs fn warmup times untimed, then repeat times; stats are in seconds
+def measure(fn, repeat=10, warmup=2):
+    for i in range(warmup):
+        fn()
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times = np.array(times)
+    return {'median': float(np.median(times)), 'min': float(times.min()),
+            'mean': float(times.mean()), 'std': float(times.std()), 'repeat': repeat}
+
+
+def machine_info():
+    return {'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'torch': torch.__version__,
+            'torch_threads': torch.get_num_threads()}
+
+
+#################################
+#                               #
+#          Benchmarks           #
+#                               #
+#  each yields (name, stats,    #
+#  extra fields) triples        #
+#                               #
+#################################
+
+#the old json.load + per-pattern list path against the memory-mapped cache
+def bench_loading(args):
+    def from_json():
+        with open(args.data, 'r') as f:
+            patterns = json.load(f)['patterns']
+        np.array([p['input'] for p in patterns[2:]], dtype=np.float32)
+
+    def cold_cache():
+        directory = tempfile.mkdtemp()
+        try:
+            np.asarray(load_recording(args.data, directory=os.path.join(directory, 'cache')).inputs).sum()
+        finally:
+            shutil.rmtree(directory)
+
+    def warm_cache():
+        np.asarray(load_recording(args.data).inputs).sum()
+
+    yield 'load/json', measure(from_json, args.repeat), {}
+    yield 'load/cache_cold', measure(cold_cache, args.repeat), {}
+    yield 'load/cache_warm', measure(warm_cache, args.repeat), {}
+
+
+#teacher forced forward over a grid of sequence lengths, batches and widths
+def bench_forward(args):
+    for hidden in args.hidden:
+        for batch in args.batch:
+            for steps in args.length:
+                seq = Sequence(hidden).float()
+                input = torch.randn(batch, steps)
+                def forward():
+                    with torch.no_grad():
+                        seq(input)
+                stats = measure(forward, args.repeat)
+                yield ('forward/h%d_b%d_t%d' % (hidden, batch, steps), stats,
+                       {'sequences_per_s': batch / stats['median']})
+
+
+#one LBFGS closure (forward + backward over the whole set) and one Adam
+#mini-batch step, on traindata.pt in float64 as main.py trains
+def bench_training(args):
+    torch.manual_seed(0)
+    input, target, test_input, test_target = load_data(args.traindata, 'float64')
+    seq = Sequence().double()
+    criterion = nn.MSELoss()
+
+    optimizer = optim.LBFGS(seq.parameters(), lr=0.8)
+    def closure():
+        optimizer.zero_grad()
+        loss = criterion(seq(input), target)
+        loss.backward()
+        return loss
+    stats = measure(closure, args.repeat)
+    yield 'train/lbfgs_closure', stats, {'sequences_per_s': input.size(0) / stats['median']}
+
+    adam = optim.Adam(seq.parameters(), lr=1e-3)
+    batch = torch.randperm(input.size(0))[:256]
+    def adam_step():
+        adam.zero_grad()
+        criterion(seq(input[batch]), target[batch]).backward()
+        adam.step()
+    stats = measure(adam_step, args.repeat)
+    yield 'train/adam_step_b256', stats, {'sequences_per_s': 256 / stats['median']}
+
+
+#one forward + backward of a [T, B, 8] window batch through the NumPy
+#engine and through the same network in torch: one LSTM layer, a linear
+#output and the binary cross entropy loss
+def bench_engines(args):
+    steps, batch, hidden = 50, 32, numpy_lstm.hidden_units
+    rng = np.random.RandomState(0)
+    inputs = rng.standard_normal((steps, batch, numpy_lstm.input_units)).astype(numpy_lstm.dtype)
+    labels = (rng.uniform(size=(steps, batch, 1)) > 0.8).astype(numpy_lstm.dtype)
+
+    parameters = numpy_lstm.init_params()
+    cache = numpy_lstm.init_cache(steps, batch)
+    def numpy_step():
+        numpy_lstm.forward_propagation(inputs, parameters, cache)
+        numpy_lstm.backward_propagation(labels, cache, parameters)
+    stats = measure(numpy_step, args.repeat)
+    yield 'engine/numpy', stats, {'samples_per_s': steps * batch / stats['median']}
+
+    lstm = nn.LSTM(numpy_lstm.input_units, hidden)
+    linear = nn.Linear(hidden, numpy_lstm.output_units)
+    x = torch.from_numpy(inputs)
+    y = torch.from_numpy(labels)
+    criterion = nn.BCEWithLogitsLoss()
+    def torch_step():
+        lstm.zero_grad()
+        linear.zero_grad()
+        criterion(linear(lstm(x)[0]), y).backward()
+    stats = measure(torch_step, args.repeat)
+    yield 'engine/torch', stats, {'samples_per_s': steps * batch / stats['median']}
+
+
+#per sample detector latency, in process (no sockets), with and without
+#the preprocessing pipeline in front
+def bench_streaming(args):
+    samples = np.array(load_recording(args.data).inputs[:args.stream_samples])
+    for name, pipeline in (('raw', None), ('preprocessed', default_pipeline())):
+        detector = BlinkDetector(Sequence(input_size=samples.shape[1]).float(), samples.shape[1])
+        latencies = []
+        for sample in samples:
+            start = time.perf_counter()
+            if pipeline is not None:
+                sample = pipeline(sample[None]).astype(np.float32)[0]
+            detector.step(sample)
+            latencies.append(time.perf_counter() - start)
+        latencies = np.array(latencies)
+        stats = {'median': float(np.median(latencies)), 'min': float(latencies.min()),
+                 'mean': float(latencies.mean()), 'std': float(latencies.std()),
+                 'repeat': len(latencies)}
+        yield 'streaming/%s' % name, stats, {'p99': float(np.percentile(latencies, 99))}
+
+
+BENCHMARKS = {
+    'loading': bench_loading,
+    'forward': bench_forward,
+    'training': bench_training,
+    'engines': bench_engines,
+    'streaming': bench_streaming,
+}
+
+
+#################################
+#                               #
+#     Baseline comparison       #
+#                               #
+#################################
+
+#median ratios against a baseline run; a ratio above threshold is a regression
+def compare(results, baseline, threshold=THRESHOLD):
+    rows = []
+    for name, current in sorted(results['results'].items()):
+        if name not in baseline['results']:
+            continue
+        ratio = current['median'] / baseline['results'][name]['median']
+        rows.append((name, baseline['results'][name]['median'], current['median'], ratio, ratio > threshold))
+    return rows
+
+
+def print_comparison(rows, threshold):
+    print('%-28s %12s %12s %8s' % ('benchmark', 'baseline ms', 'current ms', 'ratio'))
+    for name, before, after, ratio, regressed in rows:
+        print('%-28s %12.3f %12.3f %7.2fx%s' % (name, before * 1000, after * 1000, ratio,
+                                                '  REGRESSION (> %.2fx)' % threshold if regressed else ''))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark loading, forward, training, engines and streaming')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='run only these groups')
+    parser.add_argument('--data', default='data/mac_dude_BlinkTest_1.json')
+    parser.add_argument('--traindata', default='traindata.pt')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--length', type=int, nargs='+', default=[8, 100, 1000])
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 32, 256])
+    parser.add_argument('--hidden', type=int, nargs='+', default=[51, 128])
+    parser.add_argument('--stream-samples', type=int, default=2000)
+    parser.add_argument('--threads', type=int, help='torch intra-op threads (default: torch default)')
+    parser.add_argument('--out', default='bench.json', help='where the results are written')
+    parser.add_argument('--baseline', help='compare against this earlier results file')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    np.random.seed(0)
+
+    results = {'machine': machine_info(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'args': vars(args), 'results': dict()}
+    for group in args.only or sorted(BENCHMARKS):
+        for name, stats, extra in BENCHMARKS[group](args):
+            stats.update(extra)
+            results['results'][name] = stats
+            print('%-28s %10.3f ms' % (name, stats['median'] * 1000))
+            sys.stdout.flush()
+
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.threshold)
+        print_comparison(rows, args.threshold)
+        if any(row[-1] for row in rows):
+            sys.exit(1)
@@ -0,0 +1,276 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+#header fields kept alongside the cached arrays
+HEADER_KEYS = ('subject', 'test', 'sample_duration', 'iteration', 'total_patterns')
+
+#every recording starts with two all-zero padding samples (the old eeg[2:])
+PADDING = 2
+
+#one "input":[...] or "output":[...] field of a pattern object
+PATTERN_FIELD = re.compile(r'"(input|output)"\s*:\s*\[([^\]]*)\]')
+
+#the closing bracket of the patterns array (after a pattern object or empty)
+PATTERNS_END = re.compile(r'\}\s*\]|^\s*\]')
+
+#bumped whenever the on-disk layout changes so stale caches get rebuilt
+CACHE_VERSION = 2
+
+
+#the cache for data/foo.json lives in data/foo.cache/
+def cache_dir(path):
+    return os.path.splitext(path)[0] + '.cache'
+
+
+#sha1 of the source file, read in blocks so big recordings don't sit in memory
+def file_hash(path, block_size=1 << 20):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class Recording(object):
+    #inputs are float32 [N, channels], outputs float32 [N, labels]
+    def __init__(self, inputs, outputs, header):
+        self.inputs = inputs
+        self.outputs = outputs
+        self.header = header
+
+    #first output column as a flat label vector (a view, not a copy)
+    @property
+    def labels(self):
+        return self.outputs[:, 0]
+
+    def __len__(self):
+        return self.inputs.shape[0]
+
+
+#################################
+#                               #
+#     Streaming JSON parsing    #
+#                               #
+#################################
+
+#reads the scalar header fields that precede the patterns array
+#(subject, test, total_patterns, ...) without touching the samples
+def read_header(path, chunk_size=1 << 16):
+    head = ''
+    with open(path, 'r') as f:
+        while '"patterns"' not in head:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise ValueError('%s has no "patterns" array' % path)
+            head += chunk
+    head = head[:head.index('"patterns"')].rstrip().rstrip(',')
+    return json.loads(head + '}')
+
+
+#parses the "input"/"output" lists of complete pattern objects into arrays
+def parse_patterns(text, dtype):
+    fields = PATTERN_FIELD.findall(text)
+    ins = [values for name, values in fields if name == 'input']
+    outs = [values for name, values in fields if name == 'output']
+    if len(ins) != len(outs):
+        raise ValueError('pattern without matching input/output lists')
+    if not ins:
+        return None, None
+    inputs = np.fromstring(','.join(ins), dtype=dtype, sep=',')
+    outputs = np.fromstring(','.join(outs), dtype=dtype, sep=',')
+    return inputs.reshape(len(ins), -1), outputs.reshape(len(outs), -1)
+
+
+#yields (inputs, outputs) blocks of block_size rows straight from the
+#patterns array, reading chunk_size characters at a time so memory stays
+#bounded by the block and chunk sizes, whatever the file size
+#skip drops the leading padding samples; the last block may be shorter
+def iter_patterns(path, block_size=4096, skip=PADDING, dtype=np.float32, chunk_size=1 << 20):
+    pending_in, pending_out, pending = [], [], 0
+
+    with open(path, 'r') as f:
+        #find the start of the patterns array
+        buf = ''
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise ValueError('%s has no "patterns" array' % path)
+            buf += chunk
+            start = buf.find('"patterns"')
+            if start >= 0 and buf.find('[', start) >= 0:
+                buf = buf[buf.index('[', start) + 1:]
+                break
+
+        done = False
+        while not done:
+            chunk = f.read(chunk_size)
+            buf += chunk
+
+            #stop at the end of the array (trailing header keys are ignored)
+            end = PATTERNS_END.search(buf)
+            if end is not None:
+                text, buf, done = buf[:end.start() + 1], '', True
+            elif not chunk:
+                raise ValueError('%s ends inside the patterns array' % path)
+            else:
+                #only parse up to the last complete pattern object
+                last = buf.rfind('}')
+                text, buf = buf[:last + 1], buf[last + 1:]
+
+            inputs, outputs = parse_patterns(text, dtype)
+            if inputs is None:
+                continue
+
+            #drop the padding samples at the very start of the recording
+            if skip:
+                dropped = min(skip, inputs.shape[0])
+                inputs, outputs = inputs[dropped:], outputs[dropped:]
+                skip -= dropped
+
+            pending_in.append(inputs)
+            pending_out.append(outputs)
+            pending += inputs.shape[0]
+
+            #hand out full blocks, keep the remainder for the next chunk
+            if pending >= block_size:
+                inputs = np.concatenate(pending_in)
+                outputs = np.concatenate(pending_out)
+                full = (pending // block_size) * block_size
+                for i in range(0, full, block_size):
+                    yield inputs[i:i + block_size], outputs[i:i + block_size]
+                pending_in, pending_out = [inputs[full:]], [outputs[full:]]
+                pending -= full
+
+    if pending:
+        yield np.concatenate(pending_in), np.concatenate(pending_out)
+
+
+#number of samples in a recording, counted without keeping them
+def count_patterns(path):
+    return sum(block[0].shape[0] for block in iter_patterns(path, skip=0))
+
+
+#streams the patterns into preallocated .npy files, returns the rows written
+def write_columns(path, directory, total):
+    inputs = outputs = None
+    row = 0
+    for block_in, block_out in iter_patterns(path, skip=0):
+        if inputs is None:
+            inputs = np.lib.format.open_memmap(os.path.join(directory, 'inputs.npy'), mode='w+',
+                                               dtype=np.float32, shape=(total, block_in.shape[1]))
+            outputs = np.lib.format.open_memmap(os.path.join(directory, 'outputs.npy'), mode='w+',
+                                                dtype=np.float32, shape=(total, block_out.shape[1]))
+        if row + block_in.shape[0] > total:
+            return count_patterns(path)
+        inputs[row:row + block_in.shape[0]] = block_in
+        outputs[row:row + block_out.shape[0]] = block_out
+        row += block_in.shape[0]
+    if inputs is not None:
+        inputs.flush()
+        outputs.flush()
+    return row
+
+
+#parses the source json and writes the columnar cache
+def build_cache(path, directory, stat, digest):
+    header = read_header(path)
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    #total_patterns sizes the arrays up front; count if it is missing or wrong
+    total = header.get('total_patterns')
+    if total is None:
+        total = count_patterns(path)
+    rows = write_columns(path, directory, total)
+    if rows == 0:
+        raise ValueError('%s has no patterns' % path)
+    if rows != total:
+        write_columns(path, directory, rows)
+
+    meta = dict()
+    meta['version'] = CACHE_VERSION
+    meta['source_mtime'] = stat.st_mtime
+    meta['source_size'] = stat.st_size
+    meta['source_sha1'] = digest
+    meta['header'] = dict((k, header[k]) for k in HEADER_KEYS if k in header)
+    #so load_recording(directory) drops the same rows as the .json path
+    meta['padding'] = PADDING
+    write_meta(directory, meta)
+    return meta
+
+
+#meta.json is written last and atomically, so a half built cache is never trusted
+def write_meta(directory, meta):
+    tmp = os.path.join(directory, 'meta.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(directory, 'meta.json'))
+
+
+def read_meta(directory):
+    try:
+        with open(os.path.join(directory, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION:
+        return None
+    return meta
+
+
+#returns the cache metadata, rebuilding the cache if the source changed
+def ensure_cache(path, directory=None):
+    directory = directory or cache_dir(path)
+    stat = os.stat(path)
+    meta = read_meta(directory)
+
+    #same mtime and size: trust the cache without hashing
+    if meta is not None and meta['source_mtime'] == stat.st_mtime \
+            and meta['source_size'] == stat.st_size:
+        return meta
+
+    #mtime moved (copy, checkout, touch): only rebuild if the content changed
+    digest = file_hash(path)
+    if meta is not None and meta['source_sha1'] == digest:
+        meta['source_mtime'] = stat.st_mtime
+        meta['source_size'] = stat.st_size
+        write_meta(directory, meta)
+        return meta
+
+    return build_cache(path, directory, stat, digest)
+
+
+#memory-maps a directory already in the cache layout (inputs.npy,
+#outputs.npy, meta.json), e.g. one written by synth.py; skip=None drops the
+#'padding' rows meta.json records (none unless it says so)
+def load_arrays(directory, skip=None, mmap_mode='r'):
+    with open(os.path.join(directory, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    if skip is None:
+        skip = meta.get('padding', 0)
+    inputs = np.load(os.path.join(directory, 'inputs.npy'), mmap_mode=mmap_mode)
+    outputs = np.load(os.path.join(directory, 'outputs.npy'), mmap_mode=mmap_mode)
+    return Recording(inputs[skip:], outputs[skip:], meta['header'])
+
+
+#loads a blink pattern recording as memory-mapped float32 arrays
+#skip drops the leading padding samples without copying (None: the
+#source's own padding, PADDING for .json logs)
+#mmap_mode='c' gives writable copy-on-write views (torch.from_numpy wants those)
+#path may also be a directory in the cache layout, which is mapped as is
+def load_recording(path, skip=None, directory=None, mmap_mode='r'):
+    if os.path.isdir(path):
+        return load_arrays(path, skip, mmap_mode)
+    if skip is None:
+        skip = PADDING
+    directory = directory or cache_dir(path)
+    meta = ensure_cache(path, directory)
+
+    inputs = np.load(os.path.join(directory, 'inputs.npy'), mmap_mode=mmap_mode)
+    outputs = np.load(os.path.join(directory, 'outputs.npy'), mmap_mode=mmap_mode)
+    return Recording(inputs[skip:], outputs[skip:], meta['header'])
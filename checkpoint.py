@@ -0,0 +1,122 @@
+import atexit
+import copy
+import os
+import threading
+
+import numpy as np
+import torch
+
+
+#################################
+#                               #
+#    Resumable checkpoints      #
+#                               #
+#  model, optimizer (LBFGS      #
+#  history included), lr        #
+#  schedule, rng state and the  #
+#  step counter                 #
+#                               #
+#################################
+
+def rng_state():
+    return {'torch': torch.get_rng_state(), 'numpy': np.random.get_state()}
+
+def set_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+
+
+#a deep copy of everything needed to resume after step; the copy is taken on
+#the training thread so the loop can keep mutating the live tensors
+def capture(step, model, optimizer, scheduler=None, **extra):
+    state = {'step': step,
+             'model': model.state_dict(),
+             'optimizer': optimizer.state_dict(),
+             'rng': rng_state()}
+    if scheduler is not None:
+        state['scheduler'] = scheduler.state_dict()
+    state.update(extra)
+    return copy.deepcopy(state)
+
+
+#loads a captured state back into freshly built objects, returns the step
+def restore(checkpoint, model, optimizer, scheduler=None):
+    model.load_state_dict(checkpoint['model'])
+    optimizer.load_state_dict(checkpoint['optimizer'])
+    if scheduler is not None:
+        scheduler.load_state_dict(checkpoint['scheduler'])
+    set_rng_state(checkpoint['rng'])
+    return checkpoint['step']
+
+
+def load_checkpoint(path):
+    return torch.load(path, weights_only=False)
+
+
+#writes to path.tmp, fsyncs, then renames over path, so path always holds
+#either the previous or the new checkpoint, never a torn one
+def write_atomic(state, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        torch.save(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    #make the rename itself durable
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+#serialises captured states on a background thread; if saves come in faster
+#than the disk takes them, only the newest pending one is written
+class Checkpointer(object):
+    def __init__(self, path):
+        self.path = path
+        self.pending = None
+        self.closed = False
+        self.error = None
+        self.written = 0
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name='checkpointer')
+        self.thread.daemon = True
+        self.thread.start()
+        #a crash still gets the last handed over checkpoint onto disk
+        atexit.register(self.close)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                state, self.pending = self.pending, None
+            try:
+                write_atomic(state, self.path)
+                self.written += 1
+            except Exception as e:
+                self.error = e
+            with self.condition:
+                self.condition.notify_all()
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    #hands a captured state to the writer thread and returns at once
+    def save(self, state):
+        self.check()
+        with self.condition:
+            self.pending = state
+            self.condition.notify_all()
+
+    #blocks until everything handed to save() is on disk
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.check()
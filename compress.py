@@ -0,0 +1,158 @@
+from __future__ import print_function
+import argparse
+import copy
+import io
+import time
+import warnings
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.ao.quantization import quantize_dynamic
+
+from export import Forecaster, ModuleForecaster
+from main import Sequence, build_model, load_data, load_model, save_model
+
+#################################
+#                               #
+#   Edge compression            #
+#                               #
+#  int8 dynamic quantization    #
+#  of the LSTM and Linear       #
+#  layers, and structured       #
+#  pruning of hidden units      #
+#                               #
+#################################
+
+#int8 weights, activations quantized on the fly; runs on the
+#ModuleForecaster layout since the quantized LSTM has no float weights for
+#the fused kernel or lstm_cell
+def quantize(seq):
+    forecaster = ModuleForecaster.from_sequence(copy.deepcopy(seq).float())
+    with warnings.catch_warnings():
+        #eager mode quantization is deprecated in favour of torchao, which
+        #isn't a dependency here
+        warnings.simplefilter('ignore')
+        return quantize_dynamic(forecaster, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+
+
+#rows of the 4 stacked gates (i, f, g, o) belonging to hidden units index
+def gate_rows(index, hidden_size):
+    return torch.cat([index + gate * hidden_size for gate in range(4)])
+
+
+#how much the rest of the network reads each hidden unit: the norm of its
+#outgoing weights (recurrent, next layer, output)
+def unit_importance(seq):
+    first = seq.lstm1.weight_hh.norm(dim=0) + seq.lstm2.weight_ih.norm(dim=0)
+    second = seq.lstm2.weight_hh.norm(dim=0) + seq.linear.weight.norm(dim=0)
+    return first, second
+
+
+#a Sequence with only the keep most important hidden units of each layer
+def prune(seq, keep):
+    first, second = unit_importance(seq)
+    one = first.argsort(descending=True)[:keep].sort().values
+    two = second.argsort(descending=True)[:keep].sort().values
+    rows_one, rows_two = gate_rows(one, seq.hidden_size), gate_rows(two, seq.hidden_size)
+
+    pruned = Sequence(keep, seq.input_size).to(next(seq.parameters()).dtype)
+    with torch.no_grad():
+        pruned.lstm1.weight_ih.copy_(seq.lstm1.weight_ih[rows_one])
+        pruned.lstm1.weight_hh.copy_(seq.lstm1.weight_hh[rows_one][:, one])
+        pruned.lstm1.bias_ih.copy_(seq.lstm1.bias_ih[rows_one])
+        pruned.lstm1.bias_hh.copy_(seq.lstm1.bias_hh[rows_one])
+        pruned.lstm2.weight_ih.copy_(seq.lstm2.weight_ih[rows_two][:, one])
+        pruned.lstm2.weight_hh.copy_(seq.lstm2.weight_hh[rows_two][:, two])
+        pruned.lstm2.bias_ih.copy_(seq.lstm2.bias_ih[rows_two])
+        pruned.lstm2.bias_hh.copy_(seq.lstm2.bias_hh[rows_two])
+        pruned.linear.weight.copy_(seq.linear.weight[:, two])
+        pruned.linear.bias.copy_(seq.linear.bias)
+    return pruned
+
+
+#a few full batch LBFGS steps on the training rows, like main.train
+def finetune(seq, input, target, steps):
+    criterion = nn.MSELoss()
+    optimizer = optim.LBFGS(seq.parameters(), lr=0.8)
+    for i in range(steps):
+        def closure():
+            optimizer.zero_grad()
+            loss = criterion(seq(input), target)
+            loss.backward()
+            return loss
+        print('finetune step %d loss: %.6e' % (i, optimizer.step(closure).item()))
+    return seq
+
+
+#################################
+#                               #
+#         Evaluation            #
+#                               #
+#################################
+
+#serialized state dict: the deployable weights (the Forecaster holds one
+#copy of them, like Sequence)
+def size_bytes(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+#teacher forced test MSE on the held out rows, the forecast and the median
+#time per forecast sample at batch 1 (what the live detector pays);
+#quantized models take float32 input
+def evaluate(model, test_input, test_target, future, dtype=torch.float32, repeat=5):
+    input = test_input.to(dtype)
+    future_t = torch.tensor(future)
+    with torch.no_grad():
+        y = model(input, future_t)
+        mse = nn.functional.mse_loss(y[:, :input.size(1)].to(test_target.dtype), test_target).item()
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            model(input[:1], future_t)
+            times.append(time.perf_counter() - start)
+    return mse, y.double(), float(np.median(times)) / (input.size(1) + future) * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Quantize and prune the Sequence model, report size/latency/accuracy')
+    parser.add_argument('--model', help='model saved by main.py --save (default: train one with LBFGS)')
+    parser.add_argument('--data', default='traindata.pt')
+    parser.add_argument('--train-steps', type=int, default=5, help='LBFGS steps when no --model is given')
+    parser.add_argument('--keep', type=int, nargs='+', default=[32, 16], help='hidden units kept by pruning')
+    parser.add_argument('--finetune-steps', type=int, default=3)
+    parser.add_argument('--future', type=int, default=200)
+    parser.add_argument('--save', help='save pruned models as <save>_h<keep>.pt')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    torch.set_num_threads(1)
+    input, target, test_input, test_target = load_data(args.data, 'float64')
+    if args.model:
+        seq = load_model(args.model, 'float64')
+    else:
+        seq = finetune(build_model('float64'), input, target, args.train_steps)
+
+    #the pruned models get --finetune-steps more LBFGS steps; the unpruned
+    #ones get the same, so the deltas only measure the compression
+    tuned = finetune(copy.deepcopy(seq), input, target, args.finetune_steps)
+    reference = Forecaster.from_sequence(tuned)
+    variants = [('float64', reference, torch.float64),
+                ('float32', Forecaster.from_sequence(copy.deepcopy(tuned).float()), torch.float32),
+                ('int8', quantize(tuned), torch.float32)]
+    for keep in args.keep:
+        pruned = finetune(prune(seq, keep), input, target, args.finetune_steps)
+        if args.save:
+            save_model(pruned, '%s_h%d.pt' % (args.save, keep), 'float64')
+        variants.append(('h%d float32' % keep, Forecaster.from_sequence(copy.deepcopy(pruned).float()), torch.float32))
+        variants.append(('h%d int8' % keep, quantize(pruned), torch.float32))
+
+    base_mse, base_y, _ = evaluate(reference, test_input, test_target, args.future, torch.float64)
+    print('%-12s %10s %12s %12s %12s %14s' % ('model', 'size KB', 'us/sample', 'test MSE', 'MSE delta', 'forecast RMSE'))
+    for name, model, dtype in variants:
+        mse, y, us = evaluate(model, test_input, test_target, args.future, dtype)
+        drift = (y - base_y).pow(2).mean().sqrt().item()
+        print('%-12s %10.1f %12.1f %12.4e %+12.2e %14.2e' % (name, size_bytes(model) / 1e3, us, mse, mse - base_mse, drift))
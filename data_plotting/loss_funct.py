@@ -1,12 +1,20 @@
 #!/home/lela/Python/anaconda2/bin/python
 #!/home/lela/Python/anaconda2/bin/python
-from pandas import TimeGrouper
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import matplotlib.pyplot as plt
 import numpy as np
-import json
 from sklearn.neural_network import MLPClassifier
 from sklearn.preprocessing import MinMaxScaler
-from sklearn import datasets
+from threadpoolctl import threadpool_limits
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from blinkdata import load_recording
 
 #different learning rate parameters
 params = [{'solver': 'sgd', 'learning_rate': 'constant', 'momentum': 0,
@@ -37,44 +45,133 @@ plot_args = [{'c': 'red', 'linestyle': '-'},
              {'c': 'blue', 'linestyle': '--'},
              {'c': 'black', 'linestyle': '-'}]
 
-def plot_on_dataset(X, y):
-    # for each dataset, plot learning for each learning strategy
-    #X = MinMaxScaler().fit_transform(X)
-    mlps = []
-    max_iter = 400
-
-    for label, param in zip(labels, params):
-        mlp = MLPClassifier(verbose=0, random_state=0,
-                            max_iter=max_iter, **param)
-        mlp.fit(X, y)
-        mlps.append(mlp)
-    for mlp, label, args in zip(mlps, labels, plot_args):
-            plt.plot(mlp.loss_curve_, label=label, **args)
-
-parsed_json = json.load(open('../data/mac_dude_BlinkTest_1.json'))
-patterns = parsed_json['patterns']
-total_patterns = parsed_json['total_patterns']
-
-inputs = np.empty((total_patterns, 8), dtype = np.float64)
-# outputs = np.empty((total_patterns, 1), dtype = np.float64)
-outputs = np.zeros(total_patterns)
-
-i = 0
-
-for (pattern) in patterns[1:]:
-    for x in range(0,8):
-        inputs[i][x] = np.float64(pattern['input'][x])
-    outputs[i] = np.float64(pattern['output'][0])
-i+=1
-
-ax = plt.plot(linewidth = .6, fontsize = 30)
-#for tick in plt.get_xticklabels():
-#    tick.set_fontsize(25)
-plot_on_dataset(inputs, outputs)
-plt.xticks(size = 20)
-plt.yticks(size = 20)
-plt.suptitle("Loss Function of Stochatic Models of Neural Nets", fontsize = 30)
-plt.legend(labels, ncol=2, loc="upper center", fontsize = 23)
-plt.ylabel('Loss', fontsize = 30)
-plt.xlabel('Training amount in thousands', fontsize = 30)
-plt.show()
+
+#################################
+#                               #
+#     Shared memory dataset     #
+#                               #
+#################################
+
+#copies an array into a new shared memory block once; workers map it by name
+def share(array):
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    shared[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+#set in every worker by attach(): the (X, y) views of the shared blocks
+dataset = None
+blocks = []
+
+
+#pool initializer: maps the shared arrays and keeps BLAS single threaded so
+#the processes don't fight over the cores
+def attach(x_desc, y_desc):
+    global dataset
+    arrays = []
+    for name, shape, dtype in (x_desc, y_desc):
+        block = shared_memory.SharedMemory(name=name)
+        blocks.append(block)
+        arrays.append(np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf))
+    dataset = tuple(arrays)
+    threadpool_limits(1)
+
+
+#fits one configuration with one seed on the shared dataset
+def fit_one(index, seed, max_iter):
+    X, y = dataset
+    mlp = MLPClassifier(verbose=0, random_state=seed,
+                        max_iter=max_iter, **params[index])
+    start = time.perf_counter()
+    mlp.fit(X, y)
+    return {'label': labels[index], 'index': index, 'seed': seed,
+            'fit_seconds': time.perf_counter() - start, 'n_iter': mlp.n_iter_,
+            'final_loss': float(mlp.loss_curve_[-1]),
+            'loss_curve': [float(loss) for loss in mlp.loss_curve_]}
+
+
+#fans every (configuration, seed) pair out over a process pool
+def run_sweep(X, y, seeds=(0,), max_iter=400, workers=None):
+    x_block, x_desc = share(np.ascontiguousarray(X, dtype=np.float64))
+    y_block, y_desc = share(np.ascontiguousarray(y, dtype=np.float64))
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=attach,
+                                 initargs=(x_desc, y_desc)) as pool:
+            futures = [pool.submit(fit_one, index, seed, max_iter)
+                       for index in range(len(params)) for seed in seeds]
+            results = [future.result() for future in futures]
+    finally:
+        for block in (x_block, y_block):
+            block.close()
+            block.unlink()
+    return results
+
+
+#one row per configuration: mean and spread over the seeds
+def print_table(results):
+    print('%-35s %5s %8s %12s %12s' % ('optimizer', 'seeds', 'iters', 'final loss', 'fit seconds'))
+    for label in labels:
+        rows = [r for r in results if r['label'] == label]
+        if not rows:
+            continue
+        losses = np.array([r['final_loss'] for r in rows])
+        print('%-35s %5d %8.1f %6.4f+-%.4f %12.2f' % (
+            label, len(rows), np.mean([r['n_iter'] for r in rows]), losses.mean(), losses.std(),
+            np.mean([r['fit_seconds'] for r in rows])))
+
+
+#plots the seed averaged loss curve of each configuration
+def plot_results(results):
+    for label, args in zip(labels, plot_args):
+        curves = [r['loss_curve'] for r in results if r['label'] == label]
+        if not curves:
+            continue
+        #runs that converged early stop short: average what is there
+        padded = np.full((len(curves), max(len(c) for c in curves)), np.nan)
+        for i, curve in enumerate(curves):
+            padded[i, :len(curve)] = curve
+        plt.plot(np.nanmean(padded, axis=0), label=label, **args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare MLP optimizers on a blink recording')
+    parser.add_argument('--data', default='../data/mac_dude_BlinkTest_1.json')
+    parser.add_argument('--seeds', type=int, default=1, help='random seeds per configuration')
+    parser.add_argument('--max-iter', type=int, default=400)
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per core)')
+    parser.add_argument('--results', default='loss_sweep.json', help='where the results table is written')
+    parser.add_argument('--from-results', action='store_true', help='only plot a previously written results file')
+    parser.add_argument('--no-plot', action='store_true')
+    args = parser.parse_args()
+
+    if args.from_results:
+        with open(args.results, 'r') as f:
+            results = json.load(f)
+    else:
+        #loads the cached recording (converted from json on first use)
+        recording = load_recording(args.data)
+
+        #8 channel inputs and the blink label for each sample
+        inputs = recording.inputs
+        outputs = recording.labels
+
+        start = time.perf_counter()
+        results = run_sweep(inputs, outputs, range(args.seeds), args.max_iter, args.workers)
+        print('%d fits in %.1fs' % (len(results), time.perf_counter() - start))
+        with open(args.results, 'w') as f:
+            json.dump(results, f)
+    print_table(results)
+
+    if not args.no_plot:
+        ax = plt.plot(linewidth = .6, fontsize = 30)
+        #for tick in plt.get_xticklabels():
+        #    tick.set_fontsize(25)
+        plot_results(results)
+        plt.xticks(size = 20)
+        plt.yticks(size = 20)
+        plt.suptitle("Loss Function of Stochatic Models of Neural Nets", fontsize = 30)
+        plt.legend(labels, ncol=2, loc="upper center", fontsize = 23)
+        plt.ylabel('Loss', fontsize = 30)
+        plt.xlabel('Training amount in thousands', fontsize = 30)
+        plt.show()
@@ -1,35 +1,45 @@
-import json
+import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
-import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pyramid import open_pyramid
 
 #best file= mac_dude_BlinkTest_1.json
 #second best = a88ac021f60d23d32aec7764199fcfcf64c3784548eedc852c90f6a4baa24f48.json
-filename = open('../data/mac_dude_BlinkTest_1.json', 'r')
-
-#loads json file
-data = json.load(filename)
+#loads the cached recording and its min/max pyramid (built on first use)
+path = sys.argv[1] if len(sys.argv) > 1 else '../data/mac_dude_BlinkTest_1.json'
+recording, pyramid = open_pyramid(path)
 
-#stores only the eeg data
-eeg = np.array(data['patterns'])
+#one subplot per channel, all sharing the time axis
+channels = recording.inputs.shape[1]
+fig, ax = plt.subplots(channels, 1, sharex=True)
+lines = [axes.plot([], [], linewidth=.6)[0] for axes in ax]
 
-#maps the node number to the data2
-inputs = map(lambda p: p['input'], eeg[2:])
-#puts data into a list
-inputs = list(inputs)
-#puts data into an array
-inputs = np.array(inputs)
-#turns into datafram
-df = pd.DataFrame(data=inputs)
-#plots the data
-ax = df.plot(subplots = True)
+#redraws the visible range from the pyramid level that matches the pixel
+#width: each bucket is drawn as a min to max stroke, so no peak is lost
+def redraw(axes=None):
+    start, stop = ax[0].get_xlim()
+    width = int(ax[0].get_window_extent().width)
+    x, lo, hi, mean = pyramid.fetch(start, stop + 1, width)
+    x = np.repeat(x, 2)
+    for i, line in enumerate(lines):
+        line.set_data(x, np.stack((lo[:, i], hi[:, i]), 1).ravel())
+        if len(x):
+            ax[i].set_ylim(lo[:, i].min(), hi[:, i].max() + 1e-6)
+    fig.canvas.draw_idle()
 
 #Labels each subgraph
 for i,axes in enumerate(ax):
-    axes.set_ylim(auto = True)
-    axes.set_yticklabels(' ')
+    axes.set_yticks([])
     axes.legend(str(i + 1), loc = "upper left")
 
+#zooming and panning fetch just the new range
+ax[0].set_xlim(0, len(pyramid))
+redraw()
+ax[0].callbacks.connect('xlim_changed', redraw)
+
 #Title of the Graph with larger font
 plt.suptitle("Raw EEG Blink Data", fontsize=16)
 
@@ -0,0 +1,153 @@
+from __future__ import print_function
+import argparse
+import copy
+import os
+import socket
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+
+#################################
+#                               #
+#   Data-parallel training      #
+#                               #
+#  gloo process groups on CPU;  #
+#  local ranks are spawned      #
+#  here, other hosts run the    #
+#  same command with their      #
+#  --node-rank (or torchrun)    #
+#                               #
+#################################
+
+def rank():
+    return dist.get_rank() if dist.is_initialized() else 0
+
+def world_size():
+    return dist.get_world_size() if dist.is_initialized() else 1
+
+#rank 0 does all the logging, checkpointing and plotting
+def is_main():
+    return rank() == 0
+
+
+#wraps the model so backward all-reduces (averages) the gradients; a no-op
+#outside a process group
+def wrap(model):
+    if not dist.is_initialized():
+        return model
+    return DistributedDataParallel(model)
+
+
+#every rank's rows rank::world_size of a full batch tensor
+def shard(tensor):
+    return tensor[rank()::world_size()]
+
+
+#this rank's share of a batch of total rows split by shard, relative to an
+#even split. ranks can get one row more or less than each other; scaling
+#the local mean loss by this makes DDP's equal weight gradient average (and
+#all_reduce_mean of the loss) the mean over all the rows
+def shard_weight(total):
+    return len(range(rank(), total, world_size())) * world_size() / float(total)
+
+
+#mean of a scalar tensor over the ranks, so every rank sees the same value
+#(LBFGS decides when to stop from the loss, and all ranks must agree)
+def all_reduce_mean(tensor):
+    if not dist.is_initialized():
+        return tensor
+    tensor = tensor.detach().clone()
+    dist.all_reduce(tensor)
+    return tensor / world_size()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('', 0))
+        return s.getsockname()[1]
+
+
+#joins the gloo group and splits the cores between the local ranks; only
+#rank 0 prints (callers check is_main)
+def setup(global_rank, size, local_size, master_addr, master_port):
+    os.environ['MASTER_ADDR'] = master_addr
+    os.environ['MASTER_PORT'] = str(master_port)
+    dist.init_process_group('gloo', rank=global_rank, world_size=size)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_size))
+
+
+def cleanup():
+    if dist.is_initialized():
+        dist.destroy_process_group()
+
+
+def worker(local_rank, fn, args, nprocs, nnodes, node_rank, master_addr, master_port, results):
+    global_rank = node_rank * nprocs + local_rank
+    setup(global_rank, nnodes * nprocs, nprocs, master_addr, master_port)
+    try:
+        start = time.perf_counter()
+        result = fn(args)
+        elapsed = time.perf_counter() - start
+        if global_rank == 0 and results is not None:
+            results.put((result, elapsed))
+    finally:
+        cleanup()
+
+
+#runs fn(args) on nprocs local processes as ranks node_rank * nprocs ...;
+#under torchrun (RANK/WORLD_SIZE set) joins that group instead of spawning.
+#returns rank 0's (result, seconds) when rank 0 is local
+def launch(fn, args, nprocs=1, nnodes=1, node_rank=0, master_addr='127.0.0.1', master_port=None):
+    if 'RANK' in os.environ and 'WORLD_SIZE' in os.environ:
+        local_size = int(os.environ.get('LOCAL_WORLD_SIZE', 1))
+        setup(int(os.environ['RANK']), int(os.environ['WORLD_SIZE']), local_size,
+              os.environ['MASTER_ADDR'], os.environ['MASTER_PORT'])
+        try:
+            start = time.perf_counter()
+            result = fn(args)
+            return result, time.perf_counter() - start
+        finally:
+            cleanup()
+
+    if master_port is None:
+        if nnodes > 1:
+            raise ValueError('multi-node runs need an agreed --master-port')
+        master_port = free_port()
+    results = mp.get_context('spawn').SimpleQueue() if node_rank == 0 else None
+    mp.spawn(worker, args=(fn, args, nprocs, nnodes, node_rank, master_addr, master_port, results),
+             nprocs=nprocs, join=True)
+    return results.get() if results is not None else None
+
+
+#trains once per worker count and reports throughput and scaling
+#efficiency (throughput / (workers * single worker throughput))
+def scaling(fn, args, counts, sequences):
+    print('%8s %12s %14s %11s' % ('workers', 'seconds', 'sequences/s', 'efficiency'))
+    base = None
+    rows = []
+    for n in counts:
+        run = copy.copy(args)
+        result, seconds = launch(fn, run, nprocs=n)
+        throughput = sequences / seconds
+        base = base or throughput
+        rows.append((n, seconds, throughput, throughput / (n * base)))
+        print('%8d %12.2f %14.0f %10.1f%%' % (n, seconds, throughput, 100 * rows[-1][-1]))
+    return rows
+
+
+if __name__ == '__main__':
+    from main import build_parser, train_minibatch, minibatch_data
+
+    parser = argparse.ArgumentParser(parents=[build_parser(add_help=False)],
+                                     description='Measure data-parallel scaling of main.py mini-batch training')
+    parser.add_argument('--counts', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+    if args.optimizer == 'lbfgs':
+        args.optimizer = 'adam'
+    args.plot = False
+
+    dataset = minibatch_data(args)[0]
+    scaling(train_minibatch, args, args.counts, args.epochs * (len(dataset) // args.batch_size) * args.batch_size)
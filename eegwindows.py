@@ -0,0 +1,148 @@
+import torch
+from torch.utils.data import DataLoader, Dataset, Sampler
+
+from blinkdata import load_recording
+
+
+#overlapping windows over a continuous recording
+#
+#  window i covers samples [i*stride, i*stride + length)
+#  target='last'   -> label of sample i*stride + length - 1 + offset
+#  target='window' -> labels of samples [i*stride + offset, ... + length)
+#
+#inputs and labels are unfold views of the memory-mapped cache, so neither
+#the windows nor their samples are materialised; only the batches handed
+#out by __getitem__ are gathered into new tensors
+class WindowDataset(Dataset):
+    def __init__(self, path, length, stride=1, offset=0, target='last', skip=None):
+        if target not in ('last', 'window'):
+            raise ValueError("target must be 'last' or 'window', not %r" % target)
+        if offset < 0:
+            raise ValueError('offset must be >= 0')
+        self.path = path
+        self.length = length
+        self.stride = stride
+        self.offset = offset
+        self.target = target
+        self.skip = skip
+        self.views = None
+        self.num_windows = max(0, (self.open()[0].size(0) - length - offset) // stride + 1)
+
+    #(inputs, labels) window views, opened lazily so each worker process
+    #maps the cache itself instead of receiving a pickled copy
+    def open(self):
+        if self.views is None:
+            recording = load_recording(self.path, skip=self.skip, mmap_mode='c')
+            inputs = torch.from_numpy(recording.inputs)
+            labels = torch.from_numpy(recording.outputs)[:, 0]
+            self.views = (inputs, labels)
+        return self.views
+
+    def windows(self):
+        inputs, labels = self.open()
+        n = self.num_windows
+
+        #[windows, channels, length] -> [windows, length, channels]
+        x = inputs.unfold(0, self.length, self.stride)[:n].transpose(1, 2)
+        if self.target == 'last':
+            y = labels[self.length - 1 + self.offset::self.stride][:n]
+        else:
+            y = labels[self.offset:].unfold(0, self.length, self.stride)[:n]
+        return x, y
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['views'] = None
+        return state
+
+    def __len__(self):
+        return self.num_windows
+
+    #index may be a single window or a list of windows (a whole batch,
+    #gathered with one indexing call)
+    def __getitem__(self, index):
+        x, y = self.windows()
+        if not isinstance(index, int):
+            index = torch.as_tensor(index)
+        return x[index], y[index]
+
+
+#yields lists of window indices, one list per batch; reshuffled each epoch
+#from seed + epoch so runs (and workers) see the same order
+#with world_size > 1 every rank gets its rank::world_size share of each
+#batch, so together the ranks cover the same batches one process would;
+#partial last batches are dropped so no rank ends up with an empty one
+class WindowBatchSampler(Sampler):
+    def __init__(self, num_windows, batch_size, shuffle=True, drop_last=False, seed=0, rank=0, world_size=1):
+        self.num_windows = num_windows
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last or world_size > 1
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        if self.shuffle:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            order = torch.randperm(self.num_windows, generator=generator)
+        else:
+            order = torch.arange(self.num_windows)
+        for batch in range(len(self)):
+            yield order[batch * self.batch_size:(batch + 1) * self.batch_size][self.rank::self.world_size].tolist()
+
+    def __len__(self):
+        if self.drop_last:
+            return self.num_windows // self.batch_size
+        return (self.num_windows + self.batch_size - 1) // self.batch_size
+
+
+#DataLoader handing out [batch, length, channels] window batches; each
+#sampled index list is fetched as one batch, in worker processes if asked
+def window_loader(dataset, batch_size, shuffle=True, drop_last=False, num_workers=0, seed=0, rank=0, world_size=1):
+    sampler = WindowBatchSampler(len(dataset), batch_size, shuffle, drop_last, seed, rank, world_size)
+    return DataLoader(dataset, sampler=sampler, batch_size=None, num_workers=num_workers,
+                      persistent_workers=num_workers > 0)
+
+
+#consecutive [streams, chunk, ...] slices of parallel continuous streams, in
+#time order, for truncated backpropagation through time: the trainer carries
+#the state from one chunk into the next. inputs and targets are
+#[streams, T, ...]; only the chunk being handed out is copied
+class StreamChunks(object):
+    def __init__(self, inputs, targets, chunk):
+        if chunk < 1:
+            raise ValueError('chunk must be >= 1')
+        self.inputs = inputs
+        self.targets = targets
+        self.chunk = chunk
+
+    #cuts one recording into streams contiguous pieces (the remainder is
+    #dropped), so the streams walk different parts of it side by side
+    @classmethod
+    def from_recording(cls, path, streams, chunk, skip=None):
+        recording = load_recording(path, skip=skip, mmap_mode='c')
+        inputs = torch.from_numpy(recording.inputs)
+        labels = torch.from_numpy(recording.outputs)[:, 0]
+        length = inputs.size(0) // streams
+        if length < 1:
+            raise ValueError('%s is too short for %d streams' % (path, streams))
+        return cls(inputs[:streams * length].view(streams, length, -1),
+                   labels[:streams * length].view(streams, length), chunk)
+
+    @property
+    def streams(self):
+        return self.inputs.size(0)
+
+    def __len__(self):
+        return (self.inputs.size(1) + self.chunk - 1) // self.chunk
+
+    def __iter__(self):
+        for start in range(0, self.inputs.size(1), self.chunk):
+            yield (self.inputs[:, start:start + self.chunk].contiguous(),
+                   self.targets[:, start:start + self.chunk].contiguous())
@@ -0,0 +1,166 @@
+from __future__ import print_function
+import argparse
+import copy
+import time
+import warnings
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch import Tensor
+
+from infer import OnnxRunner, TorchScriptRunner
+from main import Sequence, load_model
+
+#################################
+#                               #
+#  TorchScript / ONNX export    #
+#                               #
+#  Sequence runs its encoder    #
+#  through the private fused    #
+#  kernel, which exporters      #
+#  don't handle; the            #
+#  Forecaster below does the    #
+#  same maths with one plain    #
+#  nn.LSTM holding a copy of    #
+#  the weights, and steps the   #
+#  forecast with lstm_cell      #
+#                               #
+#################################
+
+class Forecaster(nn.Module):
+    def __init__(self, hidden_size=51, input_size=1):
+        super(Forecaster, self).__init__()
+        self.lstm = nn.LSTM(input_size, hidden_size, 2, batch_first=True)
+        self.linear = nn.Linear(hidden_size, 1)
+
+    #the encoder is the cells' weights laid out as a 2 layer nn.LSTM
+    @classmethod
+    def from_sequence(cls, seq):
+        forecaster = cls(seq.hidden_size, seq.input_size).to(next(seq.parameters()).dtype)
+        state = dict()
+        for layer, cell in enumerate(('lstm1', 'lstm2')):
+            for name in ('weight_ih', 'weight_hh', 'bias_ih', 'bias_hh'):
+                weight = getattr(getattr(seq, cell), name).detach()
+                state['lstm.%s_l%d' % (name, layer)] = weight
+        for name, weight in seq.linear.state_dict().items():
+            state['linear.' + name] = weight
+        forecaster.load_state_dict(state)
+        return forecaster.eval()
+
+    #Sequence.forward(input, future) with the loop kept in the graph; the
+    #forecast steps the cells on the LSTM's own layer weights, so they are
+    #stored once. input [N, T] -> [N, T + future]
+    def forward(self, input: Tensor, future: Tensor) -> Tensor:
+        hidden, (h_n, c_n) = self.lstm(input.unsqueeze(2))
+        outputs = self.linear(hidden).squeeze(2)
+        h_t, c_t, h_t2, c_t2 = h_n[0], c_n[0], h_n[1], c_n[1]
+        output = outputs[:, -1:]
+        predictions = [outputs]
+        for i in range(int(future)):
+            h_t, c_t = torch.lstm_cell(output, (h_t, c_t), self.lstm.weight_ih_l0, self.lstm.weight_hh_l0,
+                                       self.lstm.bias_ih_l0, self.lstm.bias_hh_l0)
+            h_t2, c_t2 = torch.lstm_cell(h_t, (h_t2, c_t2), self.lstm.weight_ih_l1, self.lstm.weight_hh_l1,
+                                         self.lstm.bias_ih_l1, self.lstm.bias_hh_l1)
+            output = self.linear(h_t2)
+            predictions.append(output)
+        return torch.cat(predictions, 1)
+
+
+#steps the forecast through the nn.LSTM module instead: slower under
+#TorchScript, but the ONNX exporter can't take lstm_cell and dynamically
+#quantized LSTMs have no float layer weights to pass it
+class ModuleForecaster(Forecaster):
+    def forward(self, input: Tensor, future: Tensor) -> Tensor:
+        hidden, (h_n, c_n) = self.lstm(input.unsqueeze(2))
+        outputs = self.linear(hidden).squeeze(2)
+        output = outputs[:, -1:]
+        predictions = [outputs]
+        for i in range(int(future)):
+            hidden, (h_n, c_n) = self.lstm(output.unsqueeze(1), (h_n, c_n))
+            output = self.linear(hidden[:, 0])
+            predictions.append(output)
+        return torch.cat(predictions, 1)
+
+
+#writes prefix.ts (TorchScript) and prefix.onnx (ONNX Loop over future);
+#exported models are float32 with dynamic batch, length and future
+def export(seq, prefix, steps=8):
+    if seq.input_size != 1:
+        raise ValueError('only single input models forecast autoregressively')
+    #copies, so the caller's model keeps its dtype
+    seq = copy.deepcopy(seq).float()
+    torch.jit.script(Forecaster.from_sequence(seq)).save(prefix + '.ts')
+
+    example = (torch.zeros(1, steps), torch.tensor(1))
+    with warnings.catch_warnings():
+        #the TorchScript based exporter is the one that keeps the loop;
+        #constant folding would give the encoder and the loop's LSTM a
+        #reordered copy of the weights each
+        warnings.simplefilter('ignore')
+        torch.onnx.export(torch.jit.script(ModuleForecaster.from_sequence(seq)), example, prefix + '.onnx', dynamo=False, do_constant_folding=False,
+                          input_names=['input', 'future'], output_names=['output'],
+                          dynamic_axes={'input': {0: 'batch', 1: 'steps'}, 'output': {0: 'batch', 1: 'length'}})
+    return prefix + '.ts', prefix + '.onnx'
+
+
+#max abs difference of each exported model from eager float32 Sequence
+def parity(seq, runners, input, future):
+    with torch.no_grad():
+        eager = copy.deepcopy(seq).float()(torch.from_numpy(input), future).numpy()
+    return dict((name, float(np.abs(runner.predict(input, future) - eager).max()))
+                for name, runner in runners.items())
+
+
+#median latency in ms of each way of forecasting
+def latency(seq, runners, input, future, repeat=10):
+    tensor = torch.from_numpy(input)
+    def eager():
+        with torch.no_grad():
+            seq(tensor, future)
+    calls = {'eager': eager}
+    for name, runner in runners.items():
+        calls[name] = lambda runner=runner: runner.predict(input, future)
+    results = dict()
+    for name, call in calls.items():
+        call()
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            call()
+            times.append(time.perf_counter() - start)
+        results[name] = float(np.median(times)) * 1000
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export Sequence to TorchScript and ONNX, check parity and latency')
+    parser.add_argument('--model', help='model saved by main.py --save (default: a fresh seeded model)')
+    parser.add_argument('--out', default='sequence', help='output prefix for .ts and .onnx')
+    parser.add_argument('--steps', type=int, default=8, help='observed steps per sequence')
+    parser.add_argument('--future', type=int, default=1000)
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 32])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--tolerance', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    seq = load_model(args.model, 'float32') if args.model else Sequence().float()
+    seq.eval()
+    ts_path, onnx_path = export(seq, args.out, args.steps)
+    print('wrote %s and %s' % (ts_path, onnx_path))
+    runners = {'torchscript': TorchScriptRunner(ts_path), 'onnx': OnnxRunner(onnx_path)}
+
+    rng = np.random.RandomState(0)
+    failed = False
+    print('%6s %-12s %12s %12s' % ('batch', 'engine', 'max |diff|', 'median ms'))
+    for batch in args.batch:
+        input = rng.uniform(-1, 1, (batch, args.steps)).astype(np.float32)
+        diffs = parity(seq, runners, input, args.future)
+        times = latency(seq, runners, input, args.future, args.repeat)
+        for name in ['eager'] + sorted(runners):
+            diff = diffs.get(name, 0.0)
+            failed = failed or diff > args.tolerance
+            print('%6d %-12s %12.2e %12.2f' % (batch, name, diff, times[name]))
+    if failed:
+        raise SystemExit('exported models differ from eager by more than %g' % args.tolerance)
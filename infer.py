@@ -0,0 +1,68 @@
+from __future__ import print_function
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+
+#################################
+#                               #
+#   Deployment inference        #
+#                               #
+#  loads a model written by     #
+#  export.py (.ts TorchScript   #
+#  or .onnx) without importing  #
+#  any of the training code     #
+#                               #
+#################################
+
+class TorchScriptRunner(object):
+    def __init__(self, path):
+        self.module = torch.jit.load(path).eval()
+
+    #input [N, T] float32 -> [N, T + future] observed fit and forecast
+    def predict(self, input, future=0):
+        with torch.inference_mode():
+            return self.module(torch.from_numpy(np.ascontiguousarray(input, dtype=np.float32)),
+                               torch.tensor(future)).numpy()
+
+
+class OnnxRunner(object):
+    def __init__(self, path, threads=None):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def predict(self, input, future=0):
+        feed = {'input': np.ascontiguousarray(input, dtype=np.float32), 'future': np.array(future, dtype=np.int64)}
+        return self.session.run(None, feed)[0]
+
+
+def load_runner(path, threads=None):
+    if os.path.splitext(path)[1] == '.onnx':
+        return OnnxRunner(path, threads)
+    if threads:
+        torch.set_num_threads(threads)
+    return TorchScriptRunner(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Forecast with an exported Sequence model (.ts or .onnx)')
+    parser.add_argument('model')
+    parser.add_argument('--data', default='traindata.pt', help='rows to forecast from (the first --rows)')
+    parser.add_argument('--rows', type=int, default=3)
+    parser.add_argument('--future', type=int, default=1000)
+    parser.add_argument('--threads', type=int)
+    parser.add_argument('--out', help='save the forecasts here (.npy)')
+    args = parser.parse_args()
+
+    runner = load_runner(args.model, args.threads)
+    input = torch.load(args.data, weights_only=False)[:args.rows, :-1]
+    start = time.perf_counter()
+    y = runner.predict(input, args.future)
+    print('%s: %s forecast in %.2f ms' % (args.model, y.shape, (time.perf_counter() - start) * 1000))
+    if args.out:
+        np.save(args.out, y)
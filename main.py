@@ -1,86 +1,507 @@
 from __future__ import print_function
+import argparse
+import os
+import time
 import torch
 import torch.nn as nn
 import torch.optim as optim
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from torch.utils.data import TensorDataset
+
+import distributed
+from checkpoint import Checkpointer, capture, load_checkpoint, restore
+from eegwindows import StreamChunks, WindowDataset, window_loader
+from metrics import Metrics, ProfileWindow
+from plotting import DECIMATORS, PlotWorker
 
 class Sequence(nn.Module):
-    def __init__(self):
+    def __init__(self, hidden_size=51, input_size=1):
         super(Sequence, self).__init__()
-        self.lstm1 = nn.LSTMCell(1, 51)
-        self.lstm2 = nn.LSTMCell(51, 51)
-        self.linear = nn.Linear(51, 1)
-
-    def forward(self, input, future = 0):
-        outputs = []
-        h_t = torch.zeros(input.size(0), 51, dtype=torch.double)
-        c_t = torch.zeros(input.size(0), 51, dtype=torch.double)
-        h_t2 = torch.zeros(input.size(0), 51, dtype=torch.double)
-        c_t2 = torch.zeros(input.size(0), 51, dtype=torch.double)
-
-        for i, input_t in enumerate(input.chunk(input.size(1), dim=1)):
-            h_t, c_t = self.lstm1(input_t, (h_t, c_t))
-            h_t2, c_t2 = self.lstm2(h_t, (h_t2, c_t2))
-            output = self.linear(h_t2)
-            outputs += [output]
+        self.hidden_size = hidden_size
+        self.input_size = input_size
+        self.lstm1 = nn.LSTMCell(input_size, hidden_size)
+        self.lstm2 = nn.LSTMCell(hidden_size, hidden_size)
+        self.linear = nn.Linear(hidden_size, 1)
+
+    #the cell parameters in the order the fused 2 layer LSTM kernel takes
+    #them, so state dicts keep the lstm1/lstm2 cell layout
+    def fused_weights(self):
+        return [w for cell in (self.lstm1, self.lstm2)
+                for w in (cell.weight_ih, cell.weight_hh, cell.bias_ih, cell.bias_hh)]
+
+    #zero (h_t, c_t, h_t2, c_t2) for a batch of n sequences
+    def init_state(self, n, like):
+        return tuple(like.new_zeros(n, self.hidden_size) for i in range(4))
+
+    #teacher forced: the whole observed sequence in one fused 2 layer call
+    #input is [N, T] (or [N, T, input_size] for multi-channel models)
+    #returns the outputs [N, T] and the (h_t, c_t, h_t2, c_t2) after the last step
+    def encode(self, input, state = None):
+        if input.dim() == 2:
+            input = input.unsqueeze(2)
+        if state is None:
+            state = self.init_state(input.size(0), input)
+        h_t, c_t, h_t2, c_t2 = state
+        hx = (torch.stack((h_t, h_t2)), torch.stack((c_t, c_t2)))
+
+        #the kernel behind nn.LSTM: (input, hx, weights, has_biases, num_layers,
+        #dropout, train, bidirectional, batch_first)
+        hidden, h_n, c_n = torch._VF.lstm(input, hx, self.fused_weights(), True, 2, 0.0,
+                                          self.training, False, True)
+        outputs = self.linear(hidden).squeeze(2)
+        return outputs, (h_n[0], c_n[0], h_n[1], c_n[1])
+
+    #one cell by cell step: input_t [N, input_size] -> output [N, 1]
+    def step(self, input_t, state):
+        h_t, c_t, h_t2, c_t2 = state
+        h_t, c_t = self.lstm1(input_t, (h_t, c_t))
+        h_t2, c_t2 = self.lstm2(h_t, (h_t2, c_t2))
+        return self.linear(h_t2), (h_t, c_t, h_t2, c_t2)
+
+    #autoregressive forecast from an encoded state, written into out [N, steps]
+    #(each prediction is fed back as the next input, so input_size must be 1)
+    #(preallocated if not given). last is the previous output [N, 1]. returns
+    #out and the state after the last step, so generation can be resumed with
+    #generate(state, out[:, -1:], more_steps)
+    @torch.no_grad()
+    def generate(self, state, last, steps, out = None):
+        if out is None:
+            out = last.new_empty(last.size(0), steps)
+        output = last
+        for i in range(steps):
+            output, state = self.step(output, state)
+            out[:, i:i + 1] = output
+        return out, state
+
+    #given a state, continues from it and returns (outputs, state after the
+    #last step), so a long sequence can be fed in chunks
+    def forward(self, input, future = 0, state = None):
+        carry = state is not None
+        outputs, state = self.encode(input, state)
+
+        #autoregressive: feed each prediction back in, one cell step at a time
+        output = outputs[:, -1:]
+        predictions = []
         for i in range(future):# if we should predict the future
-            h_t, c_t = self.lstm1(output, (h_t, c_t))
-            h_t2, c_t2 = self.lstm2(h_t, (h_t2, c_t2))
-            output = self.linear(h_t2)
-            outputs += [output]
-        outputs = torch.stack(outputs, 1).squeeze(2)
-        return outputs
+            output, state = self.step(output, state)
+            predictions += [output]
+        if predictions:
+            outputs = torch.cat([outputs] + predictions, 1)
+        return (outputs, state) if carry else outputs
 
 
-if __name__ == '__main__':
+#the same state cut off from the graph that produced it, so backward stops
+#at the chunk boundary
+def detach_state(state):
+    return tuple(s.detach() for s in state)
+
+
+#precision name -> (parameter and data dtype, cpu autocast dtype or None)
+PRECISIONS = {
+    'float64': (torch.double, None),
+    'float32': (torch.float, None),
+    'bfloat16': (torch.float, torch.bfloat16),
+}
+
+def precision_dtype(precision):
+    return PRECISIONS[precision][0]
+
+#mixed precision context; a no-op for the plain float64/float32 modes
+def autocast(precision):
+    dtype = PRECISIONS[precision][1]
+    return torch.autocast('cpu', dtype=dtype or torch.bfloat16, enabled=dtype is not None)
+
+
+#loads traindata.pt and splits off the first 3 rows as the test set
+def load_data(path, precision):
+    dtype = precision_dtype(precision)
+    data = torch.load(path, weights_only=False)
+    input = torch.from_numpy(data[3:, :-1]).to(dtype)
+    target = torch.from_numpy(data[3:, 1:]).to(dtype)
+    test_input = torch.from_numpy(data[:3, :-1]).to(dtype)
+    test_target = torch.from_numpy(data[:3, 1:]).to(dtype)
+    return input, target, test_input, test_target
+
+
+def build_model(precision, hidden_size=51, input_size=1):
+    return Sequence(hidden_size, input_size).to(precision_dtype(precision))
+
+#checkpoints record the precision they were trained in; loading converts
+#the weights to whatever precision is asked for
+def save_model(seq, path, precision):
+    torch.save({'state_dict': seq.state_dict(),
+                'hidden_size': seq.hidden_size,
+                'input_size': seq.input_size,
+                'precision': precision}, path)
+
+def load_model(path, precision):
+    checkpoint = torch.load(path)
+    seq = build_model(precision, checkpoint['hidden_size'], checkpoint.get('input_size', 1))
+    seq.load_state_dict(checkpoint['state_dict'])
+    return seq
+
+
+#encodes the observed prefix once, then forecasts future steps after it;
+#returns the [N, steps + future] numpy predictions and the test loss
+def predict(seq, test_input, test_target, future, precision, criterion):
+    with torch.no_grad(), autocast(precision):
+        steps = test_input.size(1)
+        pred = torch.empty(test_input.size(0), steps + future, dtype=test_input.dtype)
+        observed, state = seq.encode(test_input)
+        pred[:, :steps] = observed
+        seq.generate(state, observed[:, -1:], future, out=pred[:, steps:])
+        loss = criterion(pred[:, :steps], test_target).item()
+        print('test loss:', loss)
+        return pred.numpy(), loss
+
+
+#renders the prediction plots off the training thread, or None with --no-plot
+#(and on every rank but 0)
+def make_plotter(args):
+    if not args.plot or not distributed.is_main():
+        return None
+    return PlotWorker(args.max_pending_plots, args.decimate)
+
+
+#the checkpoint to resume from (or None) and the background writer for new
+#ones (or None); resuming takes over the precision the run was started with.
+#every rank resumes, only rank 0 writes
+def open_checkpoints(args):
+    checkpoint = None
+    if args.resume:
+        checkpoint = load_checkpoint(args.resume)
+        if checkpoint['optimizer_name'] != args.optimizer:
+            raise ValueError('%s was written by a %s run, not %s' % (
+                args.resume, checkpoint['optimizer_name'], args.optimizer))
+        args.precision = checkpoint['precision']
+    path = args.checkpoint or args.resume
+    return checkpoint, Checkpointer(path) if path and distributed.is_main() else None
+
+
+#builds the model, from the checkpoint being resumed if there is one
+def make_model(args, checkpoint, input_size=1):
+    if checkpoint is not None:
+        return build_model(args.precision, checkpoint['hidden_size'], checkpoint['input_size'])
+    if args.load:
+        return load_model(args.load, args.precision)
+    return build_model(args.precision, input_size=input_size)
+
+
+#captures a resumable state after step steps (or epochs)
+def save_checkpoint(checkpointer, args, step, seq, optimizer, losses, scheduler=None):
+    checkpointer.save(capture(step, seq, optimizer, scheduler, losses=list(losses),
+                              optimizer_name=args.optimizer, precision=args.precision,
+                              hidden_size=seq.hidden_size, input_size=seq.input_size))
+
+
+#trains with LBFGS, returns the training loss of every step (LBFGS reports
+#its first closure evaluation, the loss going into the step)
+def train(args):
     # set random seed to 0
     np.random.seed(0)
     torch.manual_seed(0)
+    checkpoint, checkpointer = open_checkpoints(args)
     # load data and make training set
-    data = torch.load('traindata.pt')
-    input = torch.from_numpy(data[3:, :-1])
-    target = torch.from_numpy(data[3:, 1:])
-    test_input = torch.from_numpy(data[:3, :-1])
-    test_target = torch.from_numpy(data[:3, 1:])
+    input, target, test_input, test_target = load_data(args.data, args.precision)
+    # data-parallel runs train each rank on its share of the rows, its loss
+    # weighted by how many it got
+    weight = distributed.shard_weight(input.size(0))
+    input, target = distributed.shard(input), distributed.shard(target)
     # build the model
-    seq = Sequence()
-    seq.double()
+    seq = make_model(args, checkpoint)
+    model = distributed.wrap(seq)
     criterion = nn.MSELoss()
     # use LBFGS as optimizer since we can load the whole data to train
     optimizer = optim.LBFGS(seq.parameters(), lr=0.8)
+    plotter = make_plotter(args)
+    metrics = Metrics(args.metrics if distributed.is_main() else None, seq, optimizer)
+    profile = ProfileWindow(args.profile_steps if distributed.is_main() else None, args.profiler, args.profile_out)
+    losses = []
+    start = 0
+    if checkpoint is not None:
+        start = restore(checkpoint, seq, optimizer)
+        losses = checkpoint['losses']
+        if distributed.is_main():
+            print('resuming after step', start - 1)
     #begin to train
-    for i in range(15):
-        print('STEP: ', i)
+    for i in range(start, args.steps):
+        if distributed.is_main():
+            print('STEP: ', i)
+        profile.step_begin(i)
         def closure():
+            metrics.count('closure')
             optimizer.zero_grad()
-            out = seq(input)
-            loss = criterion(out, target)
-            print('loss:', loss.item())
-            loss.backward()
+            with autocast(args.precision):
+                with metrics.phase('forward'):
+                    out = model(input)
+                with metrics.phase('loss'):
+                    loss = criterion(out.to(target.dtype), target) * weight
+            with metrics.phase('backward'):
+                loss.backward()
+            #ranks see different rows: agree on the loss LBFGS compares
+            loss = distributed.all_reduce_mean(loss)
+            if distributed.is_main():
+                print('loss:', loss.item())
             return loss
-        optimizer.step(closure)
-        # begin to predict, no need to track gradient here
-        with torch.no_grad():
-            future = 1000
-            pred = seq(test_input, future=future)
-            loss = criterion(pred[:, :-future], test_target)
-            print('test loss:', loss.item())
-            y = pred.detach().numpy()
-        # draw the result
-        plt.figure(figsize=(30,10))
-        plt.title('Predict future values for time sequences\n(Dashlines are predicted values)', fontsize=30)
-        plt.xlabel('x', fontsize=20)
-        plt.ylabel('y', fontsize=20)
-        plt.xticks(fontsize=20)
-        plt.yticks(fontsize=20)
-        def draw(yi, color):
-            plt.plot(np.arange(input.size(1)), yi[:input.size(1)], color, linewidth = 2.0)
-            plt.plot(np.arange(input.size(1), input.size(1) + future), yi[input.size(1):], color + ':', linewidth = 2.0)
-        draw(y[0], 'r')
-        draw(y[1], 'g')
-        draw(y[2], 'b')
-        plt.savefig('predict%d.pdf'%i)
-plt.close()
+        #the closures' time is subtracted, leaving LBFGS's own work
+        with metrics.phase('optimizer'):
+            losses.append(optimizer.step(closure).item())
+        if checkpointer is not None and ((i + 1) % args.checkpoint_every == 0 or i + 1 == args.steps):
+            with metrics.phase('checkpoint'):
+                save_checkpoint(checkpointer, args, i + 1, seq, optimizer, losses)
+        test_loss = None
+        if distributed.is_main():
+            # begin to predict, no need to track gradient here; the forecast
+            # is only needed for the plot
+            with metrics.phase('eval'):
+                y, test_loss = predict(seq, test_input, test_target, args.future if plotter is not None else 0,
+                                       args.precision, criterion)
+        if plotter is not None:
+            # draw the result in the background (waits only if the queue is full)
+            with metrics.phase('plotting'):
+                plotter.submit(y, input.size(1), args.future, 'predict%d.%s'%(i, args.plot_format))
+        profile.step_end(i)
+        metrics.end_step(i, loss=losses[-1], test_loss=test_loss)
+    metrics.close()
+    profile.close()
+    if plotter is not None:
+        plotter.close()
+    if checkpointer is not None:
+        checkpointer.close()
+    if args.save and distributed.is_main():
+        save_model(seq, args.save, args.precision)
+    return losses
+
+
+#(dataset, test split, loss) for the mini-batch trainer: the rows of
+#traindata.pt as next value regression, or with --windows overlapping
+#windows of a memory-mapped blink recording with per-sample blink labels
+#(logits, as the streaming detector reads them)
+def minibatch_data(args):
+    if args.windows:
+        dataset = WindowDataset(args.windows, args.window_length, args.window_stride, target='window')
+        return dataset, None, nn.BCEWithLogitsLoss()
+    input, target, test_input, test_target = load_data(args.data, args.precision)
+    return TensorDataset(input, target), (test_input, test_target), nn.MSELoss()
+
+
+#(chunks, test split, loss) for truncated BPTT (--tbptt): --batch-size
+#streams cut from the --windows recording, walked --tbptt samples at a time
+#with per-sample blink labels; data-parallel ranks take a share of the streams
+def stream_data(args):
+    chunks = StreamChunks.from_recording(args.windows, args.batch_size, args.tbptt)
+    chunks.inputs, chunks.targets = distributed.shard(chunks.inputs), distributed.shard(chunks.targets)
+    return chunks, None, nn.BCEWithLogitsLoss()
+
+
+def make_optimizer(args, parameters):
+    if args.optimizer == 'adam':
+        return optim.Adam(parameters, lr=args.lr)
+    return optim.SGD(parameters, lr=args.lr, momentum=args.momentum)
+
+
+#schedules are stepped once per optimizer step
+def make_scheduler(args, optimizer, total_steps):
+    if args.schedule == 'cosine':
+        return optim.lr_scheduler.CosineAnnealingLR(optimizer, max(total_steps, 1))
+    if args.schedule == 'step':
+        return optim.lr_scheduler.StepLR(optimizer, max(total_steps // args.epochs, 1), gamma=args.gamma)
+    return optim.lr_scheduler.LambdaLR(optimizer, lambda step: 1.0)
+
+
+#trains with Adam/SGD on shuffled mini-batches, accumulating gradients over
+#args.accumulate batches per optimizer step; memory is bounded by the batch,
+#not the dataset. with --tbptt the batches are instead consecutive chunks of
+#long streams: the state is carried (detached) from chunk to chunk and
+#backward only reaches back to the start of the chunk, so memory is bounded
+#by the chunk, not the stream length. returns the mean training loss of every
+#epoch
+def train_minibatch(args):
+    np.random.seed(0)
+    torch.manual_seed(0)
+    checkpoint, checkpointer = open_checkpoints(args)
+    dtype = precision_dtype(args.precision)
+    if args.tbptt:
+        loader, test, criterion = stream_data(args)
+        input_size = loader.inputs.size(-1)
+    else:
+        dataset, test, criterion = minibatch_data(args)
+        input_size = dataset[0][0].size(-1) if args.windows else 1
+        #--batch-size is the global batch; each rank takes its share of every one
+        loader = window_loader(dataset, args.batch_size, shuffle=True, num_workers=args.workers, seed=0,
+                               rank=distributed.rank(), world_size=distributed.world_size())
+    seq = make_model(args, checkpoint, input_size)
+    model = distributed.wrap(seq)
+    optimizer = make_optimizer(args, seq.parameters())
+    updates = (len(loader) + args.accumulate - 1) // args.accumulate
+    scheduler = make_scheduler(args, optimizer, updates * args.epochs)
+    plotter = make_plotter(args) if test is not None else None
+    metrics = Metrics(args.metrics if distributed.is_main() else None, seq, optimizer)
+    profile = ProfileWindow(args.profile_steps if distributed.is_main() else None, args.profiler, args.profile_out)
+
+    losses = []
+    first = 0
+    if checkpoint is not None:
+        first = restore(checkpoint, seq, optimizer, scheduler)
+        losses = checkpoint['losses']
+        if distributed.is_main():
+            print('resuming after epoch', first - 1)
+    #ranks get one window (stream) more or less of every --batch-size batch
+    weight = distributed.shard_weight(args.batch_size)
+    for epoch in range(first, args.epochs):
+        profile.step_begin(epoch)
+        if args.tbptt:
+            #every epoch walks the streams from the start
+            state = seq.init_state(loader.streams, seq.linear.weight.detach())
+        else:
+            loader.sampler.set_epoch(epoch)
+        total, sequences = 0.0, 0
+        start = time.perf_counter()
+        optimizer.zero_grad()
+        for i, (input, target) in enumerate(metrics.iterate(loader)):
+            metrics.count('batches')
+            input, target = input.to(dtype), target.to(dtype)
+            with autocast(args.precision):
+                with metrics.phase('forward'):
+                    if args.tbptt:
+                        out, state = model(input, state=state)
+                        state = detach_state(state)
+                    else:
+                        out = model(input)
+                with metrics.phase('loss'):
+                    loss = criterion(out.to(target.dtype), target)
+            with metrics.phase('backward'):
+                (loss * weight / args.accumulate).backward()
+            #step after every accumulate batches and on the last one
+            if (i + 1) % args.accumulate == 0 or i + 1 == len(loader):
+                with metrics.phase('optimizer'):
+                    optimizer.step()
+                    optimizer.zero_grad()
+                    scheduler.step()
+                metrics.count('optimizer_steps')
+            total += loss.item() * input.size(0)
+            sequences += input.size(0)
+        elapsed = time.perf_counter() - start
+        #epoch loss and throughput over all ranks
+        totals = distributed.all_reduce_mean(torch.tensor([total, float(sequences)], dtype=torch.float64))
+        total, sequences = totals.tolist()
+        losses.append(total / sequences)
+        sequences *= distributed.world_size()
+        if distributed.is_main():
+            print('EPOCH: %d loss: %.6e lr: %.3e %.0f sequences/s' % (
+                epoch, losses[-1], scheduler.get_last_lr()[0], sequences / elapsed))
+        if checkpointer is not None and ((epoch + 1) % args.checkpoint_every == 0 or epoch + 1 == args.epochs):
+            with metrics.phase('checkpoint'):
+                save_checkpoint(checkpointer, args, epoch + 1, seq, optimizer, losses, scheduler)
+
+        test_loss = None
+        if test is not None and distributed.is_main():
+            test_input, test_target = test
+            with metrics.phase('eval'):
+                y, test_loss = predict(seq, test_input, test_target, args.future if plotter is not None else 0,
+                                       args.precision, criterion)
+        if plotter is not None:
+            with metrics.phase('plotting'):
+                plotter.submit(y, test_input.size(1), args.future, 'predict%d.%s'%(epoch, args.plot_format))
+        profile.step_end(epoch)
+        metrics.end_step(epoch, loss=losses[-1], sequences_per_s=sequences / elapsed,
+                         lr=scheduler.get_last_lr()[0], test_loss=test_loss)
+    metrics.close()
+    profile.close()
+    if plotter is not None:
+        plotter.close()
+    if checkpointer is not None:
+        checkpointer.close()
+    if args.save and distributed.is_main():
+        save_model(seq, args.save, args.precision)
+    return losses
+
+
+#trains the same seeded model in every precision and reports how far the
+#training loss drifts from the float64 run
+def compare_precisions(args):
+    results = dict()
+    for precision in PRECISIONS:
+        args.precision = precision
+        results[precision] = train(args) if args.optimizer == 'lbfgs' else train_minibatch(args)
+    reference = np.array(results['float64'])
+    print('%-10s %14s %14s %14s' % ('precision', 'final loss', 'max abs diff', 'max rel diff'))
+    for precision, losses in results.items():
+        diff = np.abs(np.array(losses) - reference)
+        print('%-10s %14.6e %14.6e %14.6e' % (precision, losses[-1], diff.max(),
+                                               (diff / np.abs(reference)).max()))
+    return results
+
+
+def run(args):
+    if args.optimizer == 'lbfgs':
+        return train(args)
+    return train_minibatch(args)
+
+
+def build_parser(add_help=True):
+    parser = argparse.ArgumentParser(description='Train the Sequence LSTM on traindata.pt', add_help=add_help)
+    parser.add_argument('--data', default='traindata.pt')
+    parser.add_argument('--steps', type=int, default=15)
+    parser.add_argument('--future', type=int, default=1000)
+    parser.add_argument('--precision', choices=sorted(PRECISIONS), default='float64')
+    parser.add_argument('--load', help='start from a model saved with --save')
+    parser.add_argument('--save', help='save the trained model here')
+    parser.add_argument('--checkpoint', help='write resumable checkpoints here (in the background)')
+    parser.add_argument('--checkpoint-every', type=int, default=1, help='steps (or epochs) between checkpoints')
+    parser.add_argument('--resume', help='continue the run saved in this checkpoint')
+    parser.add_argument('--metrics', help='append per step phase timings, counts and memory to this JSONL file')
+    parser.add_argument('--profile-steps', type=int, nargs=2, metavar=('FIRST', 'LAST'),
+                        help='profile these steps (epochs for adam/sgd), inclusive')
+    parser.add_argument('--profiler', choices=['torch', 'cprofile'], default='torch')
+    parser.add_argument('--profile-out', default='profile', help='trace file name, without extension')
+    parser.add_argument('--no-plot', dest='plot', action='store_false')
+    parser.add_argument('--plot-format', choices=['pdf', 'png'], default='pdf')
+    parser.add_argument('--decimate', choices=sorted(DECIMATORS), default='minmax',
+                        help='how forecasts are thinned to the figure width')
+    parser.add_argument('--max-pending-plots', type=int, default=2,
+                        help='figures queued for the plot thread before training waits')
+    parser.add_argument('--compare-precisions', action='store_true',
+                        help='train in every precision and report the loss divergence')
+    #mini-batch training (--optimizer adam/sgd)
+    parser.add_argument('--optimizer', choices=['lbfgs', 'adam', 'sgd'], default='lbfgs',
+                        help='lbfgs trains full batch for --steps steps, adam/sgd in mini-batch epochs')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--accumulate', type=int, default=1, help='batches per optimizer step')
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--momentum', type=float, default=0.9, help='sgd momentum')
+    parser.add_argument('--schedule', choices=['constant', 'cosine', 'step'], default='cosine')
+    parser.add_argument('--gamma', type=float, default=0.5, help='lr decay per epoch for --schedule step')
+    parser.add_argument('--workers', type=int, default=0, help='DataLoader worker processes')
+    parser.add_argument('--windows', help='train on windows of a blink recording .json instead of --data')
+    parser.add_argument('--window-length', type=int, default=250)
+    parser.add_argument('--window-stride', type=int, default=25)
+    parser.add_argument('--tbptt', type=int, metavar='LENGTH',
+                        help='truncated BPTT: walk --batch-size streams of the --windows recording '
+                             'LENGTH samples at a time, carrying the state between chunks')
+    #data-parallel training
+    parser.add_argument('--nprocs', type=int, default=1, help='local data-parallel processes')
+    parser.add_argument('--nnodes', type=int, default=1, help='hosts taking part')
+    parser.add_argument('--node-rank', type=int, default=0, help='this host, 0 .. nnodes - 1')
+    parser.add_argument('--master-addr', default='127.0.0.1', help='address of node 0')
+    parser.add_argument('--master-port', type=int, help='port on node 0 (picked at random on one host)')
+    return parser
+
+
+if __name__ == '__main__':
+    parser = build_parser()
+    args = parser.parse_args()
+    #LBFGS re-evaluates each step several times, which a carried state can't follow
+    if args.tbptt and args.optimizer == 'lbfgs':
+        parser.error('--tbptt needs --optimizer adam or sgd')
+    if args.tbptt and not args.windows:
+        parser.error('--tbptt walks a long recording, give it with --windows')
+
+    if args.compare_precisions:
+        args.plot = False
+        compare_precisions(args)
+    elif args.nprocs > 1 or args.nnodes > 1 or 'WORLD_SIZE' in os.environ:
+        distributed.launch(run, args, args.nprocs, args.nnodes, args.node_rank, args.master_addr, args.master_port)
+    else:
+        run(args)
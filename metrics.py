@@ -0,0 +1,173 @@
+import cProfile
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+import torch
+
+#shared do-nothing context handed out while metrics are off
+class NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_PHASE = NullPhase()
+
+
+#################################
+#                               #
+#   Training loop metrics       #
+#                               #
+#  per step: exclusive phase    #
+#  times, event counts, memory; #
+#  one JSON line per step       #
+#                               #
+#################################
+
+#resident set size now and at its peak, in MB
+def rss_mb():
+    with open('/proc/self/statm', 'r') as f:
+        pages = int(f.read().split()[1])
+    current = pages * os.sysconf('SC_PAGE_SIZE') / 1e6
+    #ru_maxrss is in KiB on linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak = peak / 1e6 if sys.platform == 'darwin' else peak * 1024 / 1e6
+    return current, peak
+
+
+#bytes held by the parameters, their gradients and the optimizer state
+def tensor_bytes(model, optimizer=None):
+    tensors = []
+    for p in model.parameters():
+        tensors.append(p)
+        if p.grad is not None:
+            tensors.append(p.grad)
+    if optimizer is not None:
+        for state in optimizer.state.values():
+            for value in state.values():
+                if torch.is_tensor(value):
+                    tensors.append(value)
+                elif isinstance(value, list):
+                    tensors.extend(v for v in value if torch.is_tensor(v))
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class Metrics(object):
+    def __init__(self, path=None, model=None, optimizer=None):
+        self.enabled = path is not None
+        self.model = model
+        self.optimizer = optimizer
+        self.file = open(path, 'a') if self.enabled else None
+        self.stack = []
+        self.reset()
+
+    def reset(self):
+        self.phases = dict()
+        self.counts = dict()
+        self.start = time.perf_counter()
+
+    #times a phase; nested phases are subtracted from the enclosing one, so
+    #the phase times of a step add up to its wall time at most
+    def phase(self, name):
+        if not self.enabled:
+            return NULL_PHASE
+        return self.timed(name)
+
+    @contextmanager
+    def timed(self, name):
+        frame = [time.perf_counter(), 0.0]
+        self.stack.append(frame)
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            elapsed = time.perf_counter() - frame[0]
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed - frame[1]
+            if self.stack:
+                self.stack[-1][1] += elapsed
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    #yields the items of iterable, timing each fetch as phase name
+    def iterate(self, iterable, name='data'):
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    #writes the step record and starts the next step
+    def end_step(self, step, **fields):
+        if not self.enabled:
+            return
+        record = {'step': step, 'wall': time.perf_counter() - self.start,
+                  'phases': self.phases, 'counts': self.counts}
+        record['rss_mb'], record['peak_rss_mb'] = rss_mb()
+        if self.model is not None:
+            record['tensor_mb'] = tensor_bytes(self.model, self.optimizer) / 1e6
+        record.update(fields)
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        self.reset()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+#################################
+#                               #
+#   Opt-in profiler window      #
+#                               #
+#################################
+
+#profiles steps first..last (inclusive) with torch.profiler or cProfile;
+#call step_begin(i) / step_end(i) around every step and close() after the
+#loop. a run resumed inside the window profiles the rest of it, and a run
+#ending inside it exports what was profiled
+class ProfileWindow(object):
+    def __init__(self, steps=None, kind='torch', out='profile'):
+        self.first, self.last = steps if steps else (None, None)
+        self.kind = kind
+        self.out = out
+        self.profiler = None
+
+    def step_begin(self, step):
+        if self.profiler is not None or self.first is None or not self.first <= step <= self.last:
+            return
+        if self.kind == 'torch':
+            self.profiler = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],
+                                                   record_shapes=True, profile_memory=True)
+            self.profiler.__enter__()
+        else:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def step_end(self, step):
+        if self.last is not None and step >= self.last:
+            self.close()
+
+    #stops the profiler, if running, and exports its trace
+    def close(self):
+        if self.profiler is None:
+            return
+        if self.kind == 'torch':
+            self.profiler.__exit__(None, None, None)
+            self.profiler.export_chrome_trace(self.out + '.json')
+            print(self.profiler.key_averages().table(sort_by='self_cpu_time_total', row_limit=15))
+        else:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.out + '.prof')
+            pstats.Stats(self.profiler).sort_stats('cumulative').print_stats(15)
+        self.profiler = None
@@ -0,0 +1,218 @@
+from __future__ import print_function
+import argparse
+import json
+import os
+import re
+
+import numpy as np
+
+from blinkdata import Recording
+
+#DataLogging.pde defaults, used when the header doesn't say
+SAMPLE_RATE = 250.0
+
+#the human readable ", 11:58:29.682" column in front of the unix timestamp
+TIME_COLUMN = re.compile(r',\s*\d{1,2}:\d{2}:\d{2}(?:\.\d+)?')
+
+HEADER_FIELD = re.compile(r'^%\s*([^=]+?)\s*=\s*(.*?)\s*$')
+
+
+#################################
+#                               #
+#    OpenBCI GUI text logs      #
+#                               #
+#  %OpenBCI Raw EEG Data        #
+#  %Number of channels = 8      #
+#  %Sample Rate = 250.0 Hz      #
+#  index, ch1..chN, aux1..3,    #
+#    hh:mm:ss.mmm, unix ms      #
+#                               #
+#  SDconverted-*.csv files have #
+#  no channel count and no      #
+#  timestamps                   #
+#                               #
+#################################
+
+#parses the % header and looks at the first data row to work out the layout
+def read_header(path):
+    comments = []
+    first_row = None
+    with open(path, 'r') as f:
+        for line in f:
+            if line.startswith('%'):
+                comments.append(line.rstrip('\r\n'))
+            elif line.strip():
+                first_row = line
+                break
+    if first_row is None:
+        raise ValueError('%s has no data rows' % path)
+
+    fields = dict()
+    for line in comments:
+        match = HEADER_FIELD.match(line)
+        if match:
+            fields[match.group(1).lower()] = match.group(2)
+
+    timestamps = TIME_COLUMN.search(first_row) is not None
+    columns = TIME_COLUMN.sub('', first_row).count(',') + 1
+
+    #like convertSDFile: fewer than 13 columns means an 8 channel board
+    if 'number of channels' in fields:
+        channels = int(fields['number of channels'])
+    else:
+        channels = 8 if columns - timestamps < 13 else 16
+
+    sample_rate = SAMPLE_RATE
+    if 'sample rate' in fields:
+        sample_rate = float(fields['sample rate'].split()[0])
+
+    header = dict()
+    header['channels'] = channels
+    header['sample_rate'] = sample_rate
+    header['columns'] = columns
+    header['aux_channels'] = columns - 1 - channels - timestamps
+    header['timestamps'] = timestamps
+    header['comments'] = comments
+    return header
+
+
+#parses complete text rows into a [rows, columns] float64 array in one go;
+#rows with the wrong number of columns (a truncated last line) are dropped
+def parse_rows(text, columns, timestamps):
+    if timestamps:
+        text = TIME_COLUMN.sub('', text)
+    text = text.strip()
+    if not text:
+        return np.empty((0, columns))
+    values = np.fromstring(text.replace('\n', ','), sep=',')
+    if values.size % columns:
+        lines = [line for line in text.split('\n') if line.count(',') == columns - 1]
+        values = np.fromstring(','.join(lines), sep=',') if lines else np.empty(0)
+    if values.size % columns:
+        raise ValueError('could not split rows into %d columns' % columns)
+    return values.reshape(-1, columns)
+
+
+#yields [rows, columns] blocks, reading chunk_size characters at a time
+def iter_rows(path, header, chunk_size=1 << 22):
+    columns, timestamps = header['columns'], header['timestamps']
+    with open(path, 'r') as f:
+        #skip the % header
+        skipped = 0
+        while skipped < len(header['comments']):
+            f.readline()
+            skipped += 1
+
+        rest = ''
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            text = rest + chunk
+            end = text.rfind('\n')
+            if end < 0:
+                rest = text
+                continue
+            text, rest = text[:end], text[end + 1:]
+            yield parse_rows(text, columns, timestamps)
+        if rest.strip():
+            yield parse_rows(rest, columns, timestamps)
+
+
+#upper bound on the number of data rows: every newline, plus an unterminated last line
+def count_rows(path, header, block_size=1 << 22):
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    return lines + (last != b'\n') - len(header['comments'])
+
+
+#shrinks a preallocated .npy file to its first rows rows
+def truncate_npy(path, rows):
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+        header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': fortran,
+                  'shape': (rows,) + tuple(shape[1:])}
+        #rewrite the header in place, padded to its old length
+        text = repr(header).encode('latin1')
+        size = offset - 10 if version == (1, 0) else offset - 12
+        f.seek(offset - size)
+        f.write(text + b' ' * (size - len(text) - 1) + b'\n')
+        f.truncate(offset + rows * int(np.prod(shape[1:], dtype=np.int64)) * dtype.itemsize)
+
+
+#converts a GUI log into memory-mappable arrays in directory:
+#  inputs.npy     float32 [N, channels] microvolts
+#  aux.npy        float32 [N, aux]      accelerometer/aux columns
+#  index.npy      int32   [N]           board sample index
+#  timestamps.npy int64   [N]           unix ms (raw logs only)
+#  meta.json      header, sample rate, channel count, rows
+def convert(path, directory=None, chunk_size=1 << 22):
+    directory = directory or os.path.splitext(path)[0] + '.npy.d'
+    header = read_header(path)
+    channels, aux = header['channels'], header['aux_channels']
+    rows = count_rows(path, header)
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    def create(name, dtype, shape):
+        return np.lib.format.open_memmap(os.path.join(directory, name), mode='w+', dtype=dtype, shape=shape)
+    arrays = dict()
+    arrays['index.npy'] = create('index.npy', np.int32, (rows,))
+    arrays['inputs.npy'] = create('inputs.npy', np.float32, (rows, channels))
+    arrays['aux.npy'] = create('aux.npy', np.float32, (rows, aux))
+    if header['timestamps']:
+        arrays['timestamps.npy'] = create('timestamps.npy', np.int64, (rows,))
+
+    row = 0
+    for block in iter_rows(path, header, chunk_size):
+        n = block.shape[0]
+        arrays['index.npy'][row:row + n] = block[:, 0]
+        arrays['inputs.npy'][row:row + n] = block[:, 1:1 + channels]
+        arrays['aux.npy'][row:row + n] = block[:, 1 + channels:1 + channels + aux]
+        if header['timestamps']:
+            arrays['timestamps.npy'][row:row + n] = block[:, -1]
+        row += n
+
+    #close the memmaps before any truncation
+    for array in arrays.values():
+        array.flush()
+    arrays.clear()
+    if row != rows:
+        for name in ('index.npy', 'inputs.npy', 'aux.npy', 'timestamps.npy'):
+            if os.path.exists(os.path.join(directory, name)):
+                truncate_npy(os.path.join(directory, name), row)
+
+    meta = dict(header)
+    meta['source'] = os.path.abspath(path)
+    meta['rows'] = row
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return meta
+
+
+#memory-maps a converted log; the raw logs carry no labels, so outputs is None
+def load(directory, mmap_mode='r'):
+    with open(os.path.join(directory, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    inputs = np.load(os.path.join(directory, 'inputs.npy'), mmap_mode=mmap_mode)
+    return Recording(inputs, None, meta)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert OpenBCI GUI raw EEG logs to .npy arrays')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--out', help='output directory (single file only)')
+    args = parser.parse_args()
+
+    for path in args.files:
+        meta = convert(path, args.out if len(args.files) == 1 else None)
+        print('%s: %d rows, %d channels at %g Hz' % (path, meta['rows'], meta['channels'], meta['sample_rate']))
@@ -0,0 +1,125 @@
+import os
+import queue
+import threading
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+#predict%d figures: 30in wide; pdf is vector, so size it at 72 points/inch
+FIGSIZE = (30, 10)
+DPI = {'png': 100, 'pdf': 72}
+
+
+#################################
+#                               #
+#  Decimation to pixel width    #
+#                               #
+#################################
+
+#keeps the min and max of each of width buckets, in time order, so every
+#peak survives; 2 * width points at most
+def minmax_decimate(x, y, width):
+    n = len(y)
+    if n <= 2 * width:
+        return x, y
+    edges = np.linspace(0, n, width + 1).astype(np.int64)
+    #sorting by (bucket, value) puts each bucket's min first and max last
+    bucket = np.repeat(np.arange(width), np.diff(edges))
+    order = np.lexsort((y, bucket))
+    lo, hi = order[edges[:-1]], order[edges[1:] - 1]
+    index = np.sort(np.stack((lo, hi), 1), axis=1).ravel()
+    return x[index], y[index]
+
+
+#largest triangle three buckets: threshold points that keep the visual shape
+def lttb(x, y, threshold):
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return x, y
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    index = np.empty(threshold, dtype=np.int64)
+    index[0], index[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        #average of the next bucket (the last point for the final bucket)
+        following = slice(end, edges[i + 2]) if i + 2 < len(edges) else slice(n - 1, n)
+        cx, cy = x[following].mean(), y[following].mean()
+        area = np.abs((x[a] - cx) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (cy - y[a]))
+        a = start + int(np.argmax(area))
+        index[i + 1] = a
+    return x[index], y[index]
+
+
+DECIMATORS = {
+    'minmax': lambda x, y, width: minmax_decimate(x, y, width),
+    'lttb': lambda x, y, width: lttb(x, y, 2 * width),
+    'none': lambda x, y, width: (x, y),
+}
+
+
+#################################
+#                               #
+#     Off-thread rendering      #
+#                               #
+#################################
+
+#draws the first three predictions like main.py always has: observed steps
+#solid, forecast dotted. uses a bare Figure (no pyplot), so nothing is kept
+#in pyplot's figure registry and it is safe off the main thread
+def render_prediction(y, steps, future, path, decimate='minmax'):
+    fmt = os.path.splitext(path)[1].lstrip('.') or 'pdf'
+    dpi = DPI.get(fmt, 100)
+    width = int(FIGSIZE[0] * dpi)
+    fig = Figure(figsize=FIGSIZE, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+    ax.set_title('Predict future values for time sequences\n(Dashlines are predicted values)', fontsize=30)
+    ax.set_xlabel('x', fontsize=20)
+    ax.set_ylabel('y', fontsize=20)
+    ax.tick_params(labelsize=20)
+    x = np.arange(steps + future)
+    def draw(yi, color):
+        ax.plot(*DECIMATORS[decimate](x[:steps], yi[:steps], width), color, linewidth = 2.0)
+        ax.plot(*DECIMATORS[decimate](x[steps:], yi[steps:], width), color + ':', linewidth = 2.0)
+    for yi, color in zip(y, 'rgb'):
+        draw(yi, color)
+    fig.savefig(path, format=fmt)
+
+
+#renders figures on a background thread; submit() blocks once max_pending
+#figures are waiting, which bounds the predictions held in memory
+class PlotWorker(object):
+    def __init__(self, max_pending=2, decimate='minmax'):
+        self.decimate = decimate
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='plotter')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            try:
+                render_prediction(*job, decimate=self.decimate)
+            except Exception as e:
+                self.error = e
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    #y must not be modified afterwards (main.py hands over fresh arrays)
+    def submit(self, y, steps, future, path):
+        self.check()
+        self.queue.put((y, steps, future, path))
+
+    #waits for the queued figures to be written
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.check()
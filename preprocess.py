@@ -0,0 +1,178 @@
+from __future__ import print_function
+import argparse
+import os
+
+import numpy as np
+from scipy import signal
+
+from blinkdata import load_recording
+
+#OpenBCI GUI defaults (DataProcessing.pde)
+SAMPLE_RATE = 250.0
+BANDPASS = (1.0, 50.0)
+NOTCH = 60.0
+
+
+#################################
+#                               #
+#   Stateful chunk processing   #
+#                               #
+#  every stage takes [n, chans] #
+#  chunks and carries its state #
+#  across calls, so a file cut  #
+#  into any chunk sizes gives   #
+#  the same output as one pass  #
+#                               #
+#################################
+
+#second-order-section IIR filter applied along time to every channel
+class SOSFilter(object):
+    def __init__(self, sos, name='sos'):
+        self.sos = np.asarray(sos, dtype=np.float64)
+        self.name = name
+        self.zi = None
+
+    #filter state [sections, 2, channels], zero like the GUI's filters
+    def reset(self):
+        self.zi = None
+
+    def __call__(self, chunk):
+        if self.zi is None:
+            self.zi = np.zeros((self.sos.shape[0], 2, chunk.shape[1]))
+        out, self.zi = signal.sosfilt(self.sos, chunk, axis=0, zi=self.zi)
+        return out
+
+
+#[b, a] = butter(order, [low high]/(fs/2)) as in DataProcessing.pde, in sections
+def bandpass(low=BANDPASS[0], high=BANDPASS[1], fs=SAMPLE_RATE, order=2):
+    sos = signal.butter(order, [low, high], btype='bandpass', fs=fs, output='sos')
+    return SOSFilter(sos, 'bandpass %g-%gHz' % (low, high))
+
+
+#[b, a] = butter(order, [f-1 f+1]/(fs/2), 'stop') as in DataProcessing.pde
+def notch(freq=NOTCH, fs=SAMPLE_RATE, width=2.0, order=2):
+    sos = signal.butter(order, [freq - width / 2, freq + width / 2], btype='bandstop', fs=fs, output='sos')
+    return SOSFilter(sos, 'notch %gHz' % freq)
+
+
+#per channel running mean/variance normalisation
+#every sample is scaled by the statistics of the samples up to and including
+#it, so the result does not depend on how the stream is chunked
+#window=None averages over everything seen so far, otherwise the statistics
+#are exponentially weighted with a time constant of window samples
+class RunningNorm(object):
+    def __init__(self, window=None, eps=1e-6):
+        self.window = window
+        self.eps = eps
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.shift = None
+        self.mean = None
+        self.var = None
+
+    def __call__(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if self.mean is None:
+            #sums are taken around the first sample to keep them well conditioned
+            self.shift = chunk[0].copy()
+            self.mean = np.zeros(chunk.shape[1])
+            self.var = np.zeros(chunk.shape[1])
+        if self.window is None:
+            mean, var = self.cumulative(chunk - self.shift)
+        else:
+            mean, var = self.exponential(chunk - self.shift)
+        return (chunk - self.shift - mean) / np.sqrt(var + self.eps)
+
+    #mean and (biased) variance of the first count + i + 1 samples
+    def cumulative(self, x):
+        counts = self.count + np.arange(1, x.shape[0] + 1, dtype=np.float64)[:, None]
+        sums = self.mean * self.count + np.cumsum(x, axis=0)
+        squares = (self.var + self.mean ** 2) * self.count + np.cumsum(x * x, axis=0)
+        mean = sums / counts
+        var = np.maximum(squares / counts - mean ** 2, 0)
+        self.count += x.shape[0]
+        self.mean, self.var = mean[-1], var[-1]
+        return mean, var
+
+    #mean_t = (1 - a) mean_t-1 + a x_t
+    #var_t  = (1 - a) (var_t-1 + a (x_t - mean_t-1)^2)
+    #both are first order IIR filters, so lfilter runs them with carried state
+    def exponential(self, x):
+        alpha = 1.0 / self.window
+        decay = [1.0, -(1.0 - alpha)]
+        if self.count == 0:
+            #start from the first sample instead of decaying up from zero
+            self.mean = x[0].copy()
+        mean, _ = signal.lfilter([alpha], decay, x, axis=0, zi=(1 - alpha) * self.mean[None])
+        previous = np.concatenate([self.mean[None], mean[:-1]])
+        var, _ = signal.lfilter([1.0 - alpha], decay, alpha * (x - previous) ** 2, axis=0,
+                                zi=(1 - alpha) * self.var[None])
+        self.count += x.shape[0]
+        self.mean, self.var = mean[-1], var[-1]
+        return mean, var
+
+
+#runs chunks through the stages in order
+class Pipeline(object):
+    def __init__(self, *stages):
+        self.stages = list(stages)
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def __call__(self, chunk):
+        for stage in self.stages:
+            chunk = stage(chunk)
+        return chunk
+
+
+#the GUI's default chain: 1-50Hz band-pass, 60Hz notch, then normalisation
+def default_pipeline(fs=SAMPLE_RATE, band=BANDPASS, mains=NOTCH, window=None):
+    stages = []
+    if band:
+        stages.append(bandpass(band[0], band[1], fs))
+    if mains:
+        stages.append(notch(mains, fs))
+    stages.append(RunningNorm(window))
+    return Pipeline(*stages)
+
+
+#pushes a whole (possibly memory-mapped) array through the pipeline chunk by
+#chunk; out can be a memmap too, so memory stays bounded by chunk_size
+def apply(pipeline, inputs, out=None, chunk_size=1 << 16):
+    if out is None:
+        out = np.empty(inputs.shape, dtype=np.float32)
+    for start in range(0, inputs.shape[0], chunk_size):
+        out[start:start + chunk_size] = pipeline(np.asarray(inputs[start:start + chunk_size]))
+    return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Band-pass, notch and normalise a recording into a .npy file')
+    parser.add_argument('data', help='blink recording .json or a directory written by openbci_csv.py')
+    parser.add_argument('--out', help='output .npy (default: <data>.filtered.npy)')
+    parser.add_argument('--fs', type=float, help='sample rate in Hz (default: from the log or 250)')
+    parser.add_argument('--band', type=float, nargs=2, default=list(BANDPASS))
+    parser.add_argument('--no-bandpass', action='store_true')
+    parser.add_argument('--notch', type=float, default=NOTCH, help='mains frequency, 0 disables')
+    parser.add_argument('--window', type=float, help='normalisation time constant in samples (default: cumulative)')
+    parser.add_argument('--chunk-size', type=int, default=1 << 16)
+    args = parser.parse_args()
+
+    if os.path.isdir(args.data):
+        import openbci_csv
+        recording = openbci_csv.load(args.data)
+        fs = args.fs or recording.header['sample_rate']
+    else:
+        recording = load_recording(args.data)
+        fs = args.fs or SAMPLE_RATE
+
+    pipeline = default_pipeline(fs, None if args.no_bandpass else args.band, args.notch, args.window)
+    path = args.out or os.path.splitext(args.data.rstrip('/'))[0] + '.filtered.npy'
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=recording.inputs.shape)
+    apply(pipeline, recording.inputs, out, args.chunk_size)
+    out.flush()
+    print('%s: %d samples x %d channels at %g Hz -> %s' % (args.data, out.shape[0], out.shape[1], fs, path))
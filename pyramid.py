@@ -0,0 +1,175 @@
+from __future__ import print_function
+import argparse
+import json
+import os
+
+import numpy as np
+
+from blinkdata import cache_dir, ensure_cache, load_recording
+
+#bumped whenever the on-disk layout changes so stale pyramids get rebuilt
+PYRAMID_VERSION = 1
+
+#stop adding levels once the coarsest one is this short
+MIN_BUCKETS = 256
+
+#rows of a level: bucket min, max and mean
+MIN, MAX, MEAN = 0, 1, 2
+
+
+#################################
+#                               #
+#   Min/max/mean pyramid        #
+#                               #
+#  level k summarises buckets   #
+#  of 2**k samples, per         #
+#  channel: [buckets, 3, chans] #
+#                               #
+#################################
+
+#[ceil(n / size), 3, channels] summary of x computed straight from the samples
+def summarise(x, size):
+    n, channels = x.shape
+    full = n // size
+    out = np.empty(((n + size - 1) // size, 3, channels), dtype=np.float32)
+    blocks = x[:full * size].reshape(full, size, channels)
+    out[:full, MIN] = blocks.min(1)
+    out[:full, MAX] = blocks.max(1)
+    out[:full, MEAN] = blocks.mean(1, dtype=np.float64)
+    if full * size < n:
+        tail = x[full * size:]
+        out[full] = tail.min(0), tail.max(0), tail.mean(0, dtype=np.float64)
+    return out
+
+
+#halves a level made of full buckets: min of mins, max of maxes, mean of means
+def halve(level):
+    pairs = level.reshape(-1, 2, 3, level.shape[-1])
+    out = np.empty((pairs.shape[0], 3, level.shape[-1]), dtype=np.float32)
+    out[:, MIN] = pairs[:, :, MIN].min(1)
+    out[:, MAX] = pairs[:, :, MAX].max(1)
+    out[:, MEAN] = pairs[:, :, MEAN].mean(1)
+    return out
+
+
+def level_path(directory, k):
+    return os.path.join(directory, 'level%02d.npy' % k)
+
+
+#builds every level in one streaming pass over inputs ([n, channels], may be
+#a memmap); chunks are multiples of the coarsest bucket, so each chunk's
+#buckets are complete and the finer levels can be halved into the coarser
+#ones; only the last, partial chunk is summarised from its samples
+def build_pyramid(inputs, directory, chunk_size=1 << 18, min_buckets=MIN_BUCKETS, source=None):
+    n, channels = inputs.shape
+    depth = 1
+    while n >> (depth + 1) >= min_buckets:
+        depth += 1
+    top = 1 << depth
+    chunk_size = max(top, chunk_size // top * top)
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    levels = [np.lib.format.open_memmap(level_path(directory, k), mode='w+', dtype=np.float32,
+                                        shape=((n + (1 << k) - 1) >> k, 3, channels))
+              for k in range(1, depth + 1)]
+
+    for start in range(0, n, chunk_size):
+        chunk = np.asarray(inputs[start:start + chunk_size])
+        if chunk.shape[0] == chunk_size:
+            level = summarise(chunk, 2)
+            for k in range(1, depth + 1):
+                if k > 1:
+                    level = halve(level)
+                levels[k - 1][start >> k:(start >> k) + level.shape[0]] = level
+        else:
+            for k in range(1, depth + 1):
+                level = summarise(chunk, 1 << k)
+                levels[k - 1][start >> k:] = level
+
+    for level in levels:
+        level.flush()
+    meta = {'version': PYRAMID_VERSION, 'samples': n, 'channels': channels,
+            'levels': depth, 'source': source}
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return meta
+
+
+def read_pyramid_meta(directory):
+    try:
+        with open(os.path.join(directory, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if meta.get('version') != PYRAMID_VERSION:
+        return None
+    return meta
+
+
+#serves views of a recording at whatever resolution the screen needs
+class Pyramid(object):
+    def __init__(self, inputs, directory, mmap_mode='r'):
+        self.inputs = inputs
+        self.meta = read_pyramid_meta(directory)
+        self.levels = [np.load(level_path(directory, k), mmap_mode=mmap_mode)
+                       for k in range(1, self.meta['levels'] + 1)]
+
+    def __len__(self):
+        return self.inputs.shape[0]
+
+    #coarsest level whose buckets are no wider than a pixel (0 is raw)
+    def level_for(self, start, stop, width):
+        per_pixel = max(stop - start, 1) / float(max(width, 1))
+        k = 0
+        while k < len(self.levels) and (2 << k) <= per_pixel:
+            k += 1
+        return k
+
+    #(x, lo, hi, mean) for samples [start, stop) at about width points,
+    #each [points, channels]; x is the first sample of every bucket. reads
+    #only the buckets in range, whatever the size of the recording
+    def fetch(self, start, stop, width):
+        start, stop = max(int(start), 0), min(int(stop), len(self))
+        if stop <= start:
+            empty = np.empty((0, self.inputs.shape[1]), dtype=np.float32)
+            return np.empty(0, dtype=np.int64), empty, empty, empty
+        k = self.level_for(start, stop, width)
+        if k == 0:
+            raw = np.asarray(self.inputs[start:stop])
+            return np.arange(start, stop), raw, raw, raw
+        level = self.levels[k - 1]
+        first, last = start >> k, ((stop - 1) >> k) + 1
+        buckets = np.asarray(level[first:last])
+        x = np.arange(first, last) << k
+        return x, buckets[:, MIN], buckets[:, MAX], buckets[:, MEAN]
+
+
+#the recording and its pyramid, stored in the recording's cache directory
+#and rebuilt whenever the cache was built from a different source file.
+#a cache layout directory (e.g. from synth.py) keeps its pyramid inside it,
+#rebuilt when inputs.npy changes
+def open_pyramid(path, directory=None):
+    recording = load_recording(path)
+    if os.path.isdir(path):
+        directory = directory or os.path.join(path, 'pyramid')
+        stat = os.stat(os.path.join(path, 'inputs.npy'))
+        source = '%d:%d' % (stat.st_size, stat.st_mtime_ns)
+    else:
+        directory = directory or os.path.join(cache_dir(path), 'pyramid')
+        source = ensure_cache(path)['source_sha1']
+    meta = read_pyramid_meta(directory)
+    if meta is None or meta['source'] != source or meta['samples'] != len(recording):
+        build_pyramid(recording.inputs, directory, source=source)
+    return recording, Pyramid(recording.inputs, directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the min/max/mean viewing pyramid of a recording')
+    parser.add_argument('data', nargs='+', help='blink recording .json files or cache layout directories')
+    args = parser.parse_args()
+
+    for path in args.data:
+        recording, pyramid = open_pyramid(path)
+        print('%s: %d samples, %d levels (coarsest bucket %d samples)' % (
+            path, len(recording), len(pyramid.levels), 1 << len(pyramid.levels)))
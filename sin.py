@@ -1,6 +1,11 @@
+import argparse
 import numpy as np
 import torch
 
+parser = argparse.ArgumentParser(description='Generate the sine wave traindata.pt')
+parser.add_argument('--dtype', choices=['float64', 'float32'], default='float64')
+args = parser.parse_args()
+
 np.random.seed(2)
 
 T = 20
@@ -9,5 +14,5 @@ N = 100
 
 x = np.empty((N, L), 'int64')
 x[:] = np.array(range(L)) + np.random.randint(-4 * T, 4 * T, N).reshape(N, 1)
-data = np.sin(x / 1.0 / T).astype('float64')
+data = np.sin(x / 1.0 / T).astype(args.dtype)
 torch.save(data, open('traindata.pt', 'wb'))
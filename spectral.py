@@ -0,0 +1,168 @@
+from __future__ import print_function
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import fft, signal
+
+from blinkdata import load_recording
+from preprocess import SAMPLE_RATE
+
+#OpenBCI GUI defaults (BoardCyton.pde, DataProcessing.pde, W_headPlot.pde)
+NFFT = 256
+HOP = 25
+SMOOTHING = 0.9
+BANDS = (('delta', 1, 4), ('theta', 4, 8), ('alpha', 8, 13), ('beta', 13, 30), ('gamma', 30, 55))
+#the GUI clamps amplitudes here before taking logs
+FLOOR = 0.01
+
+
+#################################
+#                               #
+#   Spectral features           #
+#                               #
+#  Hamming windowed FFT of the  #
+#  last nfft samples of every   #
+#  channel, every hop samples,  #
+#  and the power in each band,  #
+#  as W_FFT / W_BandPower show  #
+#  them                         #
+#                               #
+#################################
+
+#streams [n, chans] chunks into [frames, chans, ...] spectra; frame i covers
+#samples [i*hop, i*hop + nfft), so any chunking gives the same frames. the
+#window, bin scaling and band tables are built once, and scipy.fft keeps the
+#plan for the transform length between calls
+class Spectrogram(object):
+    def __init__(self, nfft=NFFT, hop=HOP, fs=SAMPLE_RATE, smoothing=SMOOTHING, bands=BANDS):
+        self.nfft = nfft
+        self.hop = hop
+        self.fs = fs
+        self.smoothing = smoothing
+        self.bands = bands
+        #Minim's FFT.HAMMING is the symmetric window
+        self.window = np.hamming(nfft)
+        #|X| / N, doubled except at DC and Nyquist: single sided amplitude
+        bins = nfft // 2 + 1
+        self.scale = np.full(bins, 2.0 / nfft)
+        self.scale[0] = 1.0 / nfft
+        if nfft % 2 == 0:
+            self.scale[-1] = 1.0 / nfft
+        self.freqs = np.arange(bins) * fs / nfft
+        #amplitude^2 -> psd (N/fs, quartered off the edges), summed over the
+        #bins in [low, high) of every band, as one [bins, bands] matrix
+        psd = np.full(bins, nfft / fs / 4)
+        psd[0] = nfft / fs
+        if nfft % 2 == 0:
+            psd[-1] = nfft / fs
+        self.band_weights = np.stack([psd * ((self.freqs >= low) & (self.freqs < high))
+                                      for name, low, high in bands], axis=1)
+        self.reset()
+
+    def reset(self):
+        self.tail = None
+        #log amplitude of the previous frame; the GUI's spectrum starts at zero,
+        #which it clamps to FLOOR
+        self.zi = None
+
+    @property
+    def names(self):
+        return [name for name, low, high in self.bands]
+
+    #number of whole frames in samples samples
+    def frames(self, samples):
+        return max(0, (samples - self.nfft) // self.hop + 1)
+
+    #[frames, chans, bins] smoothed amplitude spectra of the frames that end
+    #inside chunk
+    def spectrum(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64)
+        data = chunk if self.tail is None else np.concatenate([self.tail, chunk])
+        n = self.frames(data.shape[0])
+        self.tail = data[n * self.hop:].copy()
+        if n == 0:
+            return np.empty((0, data.shape[1], self.scale.size))
+
+        #[frames, chans, nfft] views, mean removed and windowed in one pass
+        frames = sliding_window_view(data, self.nfft, axis=0)[::self.hop][:n]
+        frames = (frames - frames.mean(axis=2, keepdims=True)) * self.window
+        amplitude = np.abs(fft.rfft(frames, axis=2)) * self.scale
+        if not self.smoothing:
+            return amplitude
+
+        #log a_t = (1 - s) log a + s log a_t-1, a first order IIR over frames
+        s = self.smoothing
+        if self.zi is None:
+            self.zi = np.full((1,) + amplitude.shape[1:], s * np.log(FLOOR))
+        log, self.zi = signal.lfilter([1 - s], [1, -s], np.log(np.maximum(amplitude, FLOOR)), axis=0, zi=self.zi)
+        return np.exp(log)
+
+    #[frames, chans, bands] band power of the frames that end inside chunk
+    def __call__(self, chunk):
+        amplitude = self.spectrum(chunk)
+        return np.matmul(amplitude * amplitude, self.band_weights)
+
+
+#[frames, chans * bands] (log10) band power features of a whole, possibly
+#memory-mapped, recording, chunk by chunk; out can be a memmap too
+def extract(spectrogram, inputs, out=None, chunk_size=1 << 16, log=True):
+    n = spectrogram.frames(inputs.shape[0])
+    width = inputs.shape[1] * len(spectrogram.bands)
+    if out is None:
+        out = np.empty((n, width), dtype=np.float32)
+    done = 0
+    for start in range(0, inputs.shape[0], chunk_size):
+        power = spectrogram(np.asarray(inputs[start:start + chunk_size]))
+        power = power.reshape(power.shape[0], width)
+        out[done:done + power.shape[0]] = np.log10(power + 1e-12) if log else power
+        done += power.shape[0]
+    return out
+
+
+#the label of the newest sample of every frame
+def frame_labels(labels, spectrogram):
+    n = spectrogram.frames(labels.shape[0])
+    return labels[spectrogram.nfft - 1::spectrogram.hop][:n]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Band power features of a recording, in the blinkdata cache layout')
+    parser.add_argument('data', help='blink recording .json or a cache layout directory (e.g. from synth.py)')
+    parser.add_argument('out', help='output directory (inputs.npy, outputs.npy, meta.json)')
+    parser.add_argument('--fs', type=float, default=SAMPLE_RATE)
+    parser.add_argument('--nfft', type=int, default=NFFT)
+    parser.add_argument('--hop', type=int, default=HOP, help='samples between frames')
+    parser.add_argument('--smoothing', type=float, default=SMOOTHING, help='0 disables')
+    parser.add_argument('--linear', action='store_true', help='linear power instead of log10')
+    parser.add_argument('--chunk-size', type=int, default=1 << 16)
+    args = parser.parse_args()
+
+    recording = load_recording(args.data)
+    spectrogram = Spectrogram(args.nfft, args.hop, args.fs, args.smoothing)
+    n = spectrogram.frames(len(recording))
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out)
+    inputs = np.lib.format.open_memmap(os.path.join(args.out, 'inputs.npy'), mode='w+', dtype=np.float32,
+                                       shape=(n, recording.inputs.shape[1] * len(BANDS)))
+    start = time.perf_counter()
+    extract(spectrogram, recording.inputs, inputs, args.chunk_size, not args.linear)
+    elapsed = time.perf_counter() - start
+    inputs.flush()
+    outputs = np.lib.format.open_memmap(os.path.join(args.out, 'outputs.npy'), mode='w+', dtype=np.float32,
+                                        shape=(n, recording.outputs.shape[1]))
+    outputs[:] = frame_labels(recording.outputs, spectrogram)
+    outputs.flush()
+
+    header = dict(recording.header, total_patterns=n)
+    meta = {'header': header, 'source': args.data, 'sample_rate': args.fs / args.hop, 'nfft': args.nfft,
+            'hop': args.hop, 'smoothing': args.smoothing, 'log': not args.linear,
+            'features': ['%s %d' % (name, chan) for chan in range(recording.inputs.shape[1])
+                         for name in spectrogram.names]}
+    with open(os.path.join(args.out, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    print('%s: %d samples x %d channels -> %d frames x %d features in %.1fs -> %s' % (
+        args.data, len(recording), recording.inputs.shape[1], n, inputs.shape[1], elapsed, args.out))
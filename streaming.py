@@ -0,0 +1,264 @@
+from __future__ import print_function
+import argparse
+import asyncio
+import collections
+import json
+import struct
+import sys
+import time
+
+import numpy as np
+import torch
+
+from blinkdata import load_recording
+from main import Sequence, load_model
+from preprocess import default_pipeline
+
+#OpenBCI GUI networking widget defaults (W_networking.pde)
+SAMPLE_RATE = 250
+PORT = 12345
+OSC_ADDRESS = '/openbci'
+#per sample latencies kept for the report: the last minute, so a server
+#left running doesn't grow without bound
+LATENCY_WINDOW = 60 * SAMPLE_RATE
+
+
+#################################
+#                               #
+#   OpenBCI networking packets  #
+#                               #
+#################################
+
+#UDP time series: one {"type":"eeg","data":[...]} line per sample
+def parse_udp(packet):
+    samples = []
+    for line in packet.split(b'\n'):
+        line = line.strip()
+        if not line:
+            continue
+        message = json.loads(line)
+        if message.get('type') == 'eeg':
+            samples.append(message['data'])
+    return samples
+
+def format_udp(sample):
+    return ('{"type":"eeg","data":[%s]}\r\n' % ','.join(repr(float(x)) for x in sample)).encode()
+
+
+#OSC strings are null terminated and padded to 4 bytes
+def osc_string(packet, offset):
+    end = packet.index(b'\0', offset)
+    return packet[offset:end].decode(), (end + 4) & ~3
+
+def osc_pad(text):
+    data = text.encode() + b'\0'
+    return data + b'\0' * (-len(data) % 4)
+
+#OSC time series: one message per sample with a float argument per channel
+#(bundles are unpacked, non float arguments are ignored)
+def parse_osc(packet, address=OSC_ADDRESS):
+    if packet.startswith(b'#bundle\0'):
+        samples, offset = [], 16
+        while offset < len(packet):
+            size, = struct.unpack_from('>i', packet, offset)
+            samples += parse_osc(packet[offset + 4:offset + 4 + size], address)
+            offset += 4 + size
+        return samples
+
+    path, offset = osc_string(packet, 0)
+    if path != address:
+        return []
+    tags, offset = osc_string(packet, offset)
+    sample = []
+    for tag in tags[1:]:
+        if tag in 'fi':
+            value, = struct.unpack_from('>f' if tag == 'f' else '>i', packet, offset)
+            sample.append(value)
+            offset += 4
+        elif tag == 'd':
+            sample.append(struct.unpack_from('>d', packet, offset)[0])
+            offset += 8
+    return [sample]
+
+def format_osc(sample, address=OSC_ADDRESS):
+    return osc_pad(address) + osc_pad(',' + 'f' * len(sample)) + struct.pack('>%df' % len(sample), *sample)
+
+
+PARSERS = {'udp': parse_udp, 'osc': parse_osc}
+FORMATTERS = {'udp': format_udp, 'osc': format_osc}
+
+
+#fixed size history of the last capacity samples, one row per channel
+class RingBuffer(object):
+    def __init__(self, channels, capacity):
+        self.data = np.zeros((channels, capacity), dtype=np.float32)
+        self.capacity = capacity
+        self.count = 0
+
+    def push(self, sample):
+        self.data[:, self.count % self.capacity] = sample
+        self.count += 1
+
+    #the last n samples of every channel, oldest first
+    def latest(self, n):
+        n = min(n, self.count, self.capacity)
+        end = self.count % self.capacity
+        if n <= end:
+            return self.data[:, end - n:end]
+        return np.concatenate((self.data[:, end - n:], self.data[:, :end]), axis=1)
+
+
+#runs the LSTM one step per sample, carrying (h_t, c_t, h_t2, c_t2) between
+#samples instead of re-running whole windows; the model output is read as
+#a blink logit
+class BlinkDetector(object):
+    def __init__(self, seq, channels, threshold=0.5, refractory=SAMPLE_RATE // 4, channel=0):
+        self.seq = seq.eval()
+        self.dtype = next(seq.parameters()).dtype
+        #single input models see one channel, multi-channel models all of them
+        self.channels = slice(None) if seq.input_size == channels else slice(channel, channel + 1)
+        self.state = seq.init_state(1, torch.zeros(0, dtype=self.dtype))
+        self.input = torch.zeros(1, seq.input_size, dtype=self.dtype)
+        self.threshold = threshold
+        self.refractory = refractory
+        self.last_detection = -refractory
+        self.samples = 0
+
+    #returns the blink probability, and whether it starts a new detection
+    def step(self, sample):
+        with torch.inference_mode():
+            self.input[0] = torch.from_numpy(sample[self.channels])
+            output, self.state = self.seq.step(self.input, self.state)
+            probability = torch.sigmoid(output).item()
+        self.samples += 1
+
+        detected = probability >= self.threshold and self.samples - self.last_detection >= self.refractory
+        if detected:
+            self.last_detection = self.samples
+        return probability, detected
+
+
+#asyncio datagram endpoint: parses packets, fills the ring buffer and steps
+#the detector as soon as a sample arrives; detections go to a queue
+#preprocess (a preprocess.Pipeline) filters each packet before the detector
+#sees it, the ring buffer keeps the raw samples. latencies holds the
+#latest LATENCY_WINDOW per sample latencies
+class StreamProtocol(asyncio.DatagramProtocol):
+    def __init__(self, detector, buffer, detections, protocol='udp', preprocess=None):
+        self.detector = detector
+        self.buffer = buffer
+        self.detections = detections
+        self.parse = PARSERS[protocol]
+        self.preprocess = preprocess
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def datagram_received(self, packet, address):
+        received = time.perf_counter()
+        try:
+            samples = self.parse(packet)
+        except (ValueError, struct.error):
+            return
+        if not samples:
+            return
+        samples = np.asarray(samples, dtype=np.float32)
+        filtered = samples
+        if self.preprocess is not None:
+            filtered = self.preprocess(samples).astype(np.float32)
+        for sample, features in zip(samples, filtered):
+            self.buffer.push(sample)
+            probability, detected = self.detector.step(features)
+            latency = time.perf_counter() - received
+            self.latencies.append(latency)
+            if detected:
+                self.detections.put_nowait({'sample': self.buffer.count, 'probability': probability,
+                                            'latency_ms': latency * 1000})
+
+
+#p50/p99/max latency in milliseconds (of the latest LATENCY_WINDOW samples
+#when they come from serve)
+def latency_report(latencies):
+    latencies = np.array(latencies) * 1000
+    return {'samples': len(latencies),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'max_ms': float(latencies.max()),
+            'sample_period_ms': 1000.0 / SAMPLE_RATE}
+
+
+async def serve(detector, buffer, host='127.0.0.1', port=PORT, protocol='udp', duration=None, preprocess=None):
+    loop = asyncio.get_running_loop()
+    detections = asyncio.Queue()
+    transport, endpoint = await loop.create_datagram_endpoint(
+        lambda: StreamProtocol(detector, buffer, detections, protocol, preprocess), local_addr=(host, port))
+
+    #prints detections as json lines until the duration runs out
+    async def emit():
+        while True:
+            print(json.dumps(await detections.get()))
+            sys.stdout.flush()
+
+    emitter = asyncio.ensure_future(emit())
+    try:
+        if duration is None:
+            await asyncio.Future()
+        await asyncio.sleep(duration)
+    finally:
+        emitter.cancel()
+        transport.close()
+    return endpoint.latencies
+
+
+#plays a recording back at rate samples/s the way the GUI would send it;
+#sends are scheduled against absolute deadlines so the rate does not drift
+async def replay(path, host='127.0.0.1', port=PORT, protocol='udp', rate=SAMPLE_RATE, limit=None):
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol, remote_addr=(host, port))
+    inputs = load_recording(path).inputs
+    if limit:
+        inputs = inputs[:limit]
+    format_packet = FORMATTERS[protocol]
+    start = loop.time()
+    for i in range(inputs.shape[0]):
+        delay = start + i / float(rate) - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        transport.sendto(format_packet(inputs[i].tolist()))
+    transport.close()
+    return inputs.shape[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Real-time blink detection from the OpenBCI GUI networking widget')
+    parser.add_argument('mode', choices=['serve', 'replay'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--protocol', choices=sorted(PARSERS), default='udp')
+    parser.add_argument('--channels', type=int, default=8)
+    parser.add_argument('--model', help='checkpoint saved by main.py --save (default: untrained 8 channel model)')
+    parser.add_argument('--channel', type=int, default=0, help='channel fed to single input models')
+    parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--duration', type=float, help='serve for this many seconds, then print latencies')
+    parser.add_argument('--data', default='data/mac_dude_BlinkTest_1.json')
+    parser.add_argument('--rate', type=float, default=SAMPLE_RATE)
+    parser.add_argument('--limit', type=int, help='replay only this many samples')
+    parser.add_argument('--preprocess', action='store_true',
+                        help='band-pass, notch and normalise samples before the detector')
+    parser.add_argument('--notch', type=float, default=60.0, help='mains frequency for --preprocess')
+    args = parser.parse_args()
+
+    if args.mode == 'replay':
+        sent = asyncio.run(replay(args.data, args.host, args.port, args.protocol, args.rate, args.limit))
+        print('sent %d samples' % sent)
+    else:
+        torch.set_num_threads(1)
+        if args.model:
+            seq = load_model(args.model, 'float32')
+        else:
+            seq = Sequence(input_size=args.channels)
+        detector = BlinkDetector(seq, args.channels, args.threshold, channel=args.channel)
+        buffer = RingBuffer(args.channels, 10 * SAMPLE_RATE)
+        preprocess = default_pipeline(SAMPLE_RATE, mains=args.notch) if args.preprocess else None
+        latencies = asyncio.run(serve(detector, buffer, args.host, args.port, args.protocol, args.duration,
+                                      preprocess))
+        if latencies:
+            print(json.dumps(latency_report(latencies)))
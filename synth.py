@@ -0,0 +1,169 @@
+from __future__ import print_function
+import argparse
+import json
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from blinkdata import load_arrays
+
+SAMPLE_RATE = 250.0
+
+#samples generated per task; every block has its own random stream, so the
+#output depends only on the seed, not on the number of processes
+BLOCK_SIZE = 1 << 18
+
+#signal mix, amplitudes in microvolts like the OpenBCI GUI logs
+DEFAULTS = {
+    'channels': 8,
+    'alpha_uv': 10.0,       #8-12 Hz, waxing and waning
+    'beta_uv': 4.0,         #13-30 Hz
+    'noise_uv': 8.0,        #1/f background
+    'mains_uv': 5.0,
+    'mains_hz': 60.0,
+    'blink_rate': 15.0,     #blinks per minute
+    'blink_uv': 150.0,
+    'blink_seconds': 0.4,
+}
+
+
+#################################
+#                               #
+#   Synthetic EEG recordings    #
+#                               #
+#  alpha + beta oscillations,   #
+#  1/f noise, mains hum and     #
+#  labelled blink artefacts     #
+#                               #
+#################################
+
+#per channel constants drawn once from the seed: frequencies, phases and
+#how strongly each channel picks up blinks (frontal channels 1-2 the most)
+def channel_params(seed, channels):
+    rng = np.random.default_rng([seed, 0])
+    blink_gain = np.exp(-np.arange(channels) / 2.0)
+    return {
+        'alpha_hz': rng.uniform(8.0, 12.0, channels),
+        'beta_hz': rng.uniform(13.0, 30.0, (2, channels)),
+        'phase': rng.uniform(0, 2 * np.pi, (4, channels)),
+        'alpha_mod_hz': rng.uniform(0.05, 0.2, channels),
+        'blink_gain': blink_gain * rng.uniform(0.8, 1.2, channels),
+    }
+
+
+#blink centres (in samples) falling in block b, drawn from that block's own
+#stream so neighbouring blocks can recompute them
+def blink_times(seed, block, samples, config):
+    rng = np.random.default_rng([seed, 2, block])
+    start = block * BLOCK_SIZE
+    stop = min(start + BLOCK_SIZE, samples)
+    expected = config['blink_rate'] / 60.0 * (stop - start) / SAMPLE_RATE
+    return np.sort(rng.uniform(start, stop, rng.poisson(expected)))
+
+
+#1/f noise for a block: white noise shaped in the frequency domain
+def pink_noise(rng, n, channels):
+    spectrum = np.fft.rfft(rng.standard_normal((n, channels)), axis=0)
+    f = np.fft.rfftfreq(n)
+    f[0] = f[1] if n > 1 else 1.0
+    spectrum /= np.sqrt(f / f[-1])[:, None]
+    spectrum[0] = 0
+    noise = np.fft.irfft(spectrum, n, axis=0)
+    return noise / (noise.std(0) + 1e-12)
+
+
+#([n, channels] inputs, [n, 1] labels) for samples [start, start + n)
+def generate_block(seed, block, samples, config):
+    start = block * BLOCK_SIZE
+    n = min(BLOCK_SIZE, samples - start)
+    channels = config['channels']
+    params = channel_params(seed, channels)
+    rng = np.random.default_rng([seed, 1, block])
+
+    #oscillations run on absolute time, so they are continuous across blocks
+    t = (start + np.arange(n))[:, None] / SAMPLE_RATE
+    phase = params['phase']
+    envelope = 1 + 0.5 * np.sin(2 * np.pi * params['alpha_mod_hz'] * t + phase[1])
+    x = config['alpha_uv'] * envelope * np.sin(2 * np.pi * params['alpha_hz'] * t + phase[0])
+    x += config['beta_uv'] * np.sin(2 * np.pi * params['beta_hz'][0] * t + phase[2])
+    x += 0.5 * config['beta_uv'] * np.sin(2 * np.pi * params['beta_hz'][1] * t + phase[3])
+    x += config['mains_uv'] * np.sin(2 * np.pi * config['mains_hz'] * t)
+    x += config['noise_uv'] * pink_noise(rng, n, channels)
+
+    #blinks from this block and its neighbours that reach into it: a raised
+    #cosine bump, labelled 1 while it lasts
+    labels = np.zeros((n, 1), dtype=np.float32)
+    half = config['blink_seconds'] * SAMPLE_RATE / 2
+    for b in (block - 1, block, block + 1):
+        if b < 0 or b * BLOCK_SIZE >= samples:
+            continue
+        for centre in blink_times(seed, b, samples, config):
+            lo = max(int(np.ceil(centre - half)), start)
+            hi = min(int(np.floor(centre + half)) + 1, start + n)
+            if lo >= hi:
+                continue
+            shape = 0.5 * (1 + np.cos(np.pi * (np.arange(lo, hi) - centre) / half))
+            x[lo - start:hi - start] += config['blink_uv'] * shape[:, None] * params['blink_gain']
+            labels[lo - start:hi - start] = 1
+    return x.astype(np.float32), labels
+
+
+#pool worker: generates one block and writes it into the shared .npy files
+def write_block(task):
+    directory, seed, block, samples, config = task
+    inputs, labels = generate_block(seed, block, samples, config)
+    start = block * BLOCK_SIZE
+    for name, array in (('inputs.npy', inputs), ('outputs.npy', labels)):
+        out = np.load(os.path.join(directory, name), mmap_mode='r+')
+        out[start:start + array.shape[0]] = array
+        out.flush()
+        del out
+    return array.shape[0]
+
+
+#writes a recording in the blinkdata cache layout (inputs.npy [n, channels],
+#outputs.npy [n, 1], meta.json), so load_recording(directory) maps it
+def generate(directory, samples, seed=0, workers=None, **config):
+    config = dict(DEFAULTS, **config)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for name, width in (('inputs.npy', config['channels']), ('outputs.npy', 1)):
+        np.lib.format.open_memmap(os.path.join(directory, name), mode='w+', dtype=np.float32,
+                                  shape=(samples, width)).flush()
+
+    blocks = (samples + BLOCK_SIZE - 1) // BLOCK_SIZE
+    tasks = [(directory, seed, b, samples, config) for b in range(blocks)]
+    if workers == 1:
+        list(map(write_block, tasks))
+    else:
+        with Pool(workers) as pool:
+            list(pool.imap_unordered(write_block, tasks))
+
+    header = {'subject': 'synthetic', 'test': 'BlinkTest', 'total_patterns': samples}
+    meta = {'header': header, 'seed': seed, 'sample_rate': SAMPLE_RATE, 'config': config}
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return meta
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic EEG recording with labelled blinks')
+    parser.add_argument('out', help='output directory (inputs.npy, outputs.npy, meta.json)')
+    parser.add_argument('--hours', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, help='processes (default: one per core)')
+    for key, value in sorted(DEFAULTS.items()):
+        parser.add_argument('--' + key.replace('_', '-'), type=type(value), default=value)
+    args = parser.parse_args()
+
+    config = dict((key, getattr(args, key)) for key in DEFAULTS)
+    samples = int(args.hours * 3600 * SAMPLE_RATE)
+    start = time.perf_counter()
+    generate(args.out, samples, args.seed, args.workers, **config)
+    elapsed = time.perf_counter() - start
+    recording = load_arrays(args.out)
+    print('%s: %d samples x %d channels (%.1f MB) in %.1fs, %.1f%% blink labels' % (
+        args.out, len(recording), recording.inputs.shape[1], recording.inputs.nbytes / 1e6,
+        elapsed, 100 * float(np.mean(recording.labels))))